@@ -0,0 +1,202 @@
+"""
+出力トークン数の分布を学習するモジュール
+(問題の種類, 難易度, モデル) ごとの実績から max_tokens と料金・処理時間を予測する
+"""
+
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import deque
+from statistics import median
+from typing import Dict, Any, Deque, List, Optional, Tuple
+
+StatsKey = Tuple[str, str, str]
+
+
+def _percentile(sorted_values: list, percentile: float) -> float:
+    """最近接順位法によるパーセンタイル"""
+    rank = max(math.ceil(percentile / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class CompletionLengthStats:
+    def __init__(self, path: Optional[str] = None, window: int = 500, percentile: float = 95.0,
+                 margin: float = 1.2, min_samples: int = 20, floor: int = 256, ceiling: int = 4096,
+                 autosave: bool = True):
+        """
+        出力トークン統計の初期化
+
+        Args:
+            path: 統計の保存先（JSON）。指定すると既存の統計を読み込む（省略時は保存しない）
+            window: キーごとに保持する直近のサンプル数
+            percentile: max_tokens の基準にするパーセンタイル
+            margin: パーセンタイルに掛ける余裕分
+            min_samples: max_tokens を設定するのに必要なサンプル数
+            floor: max_tokens の下限
+            ceiling: max_tokens の上限（打ち切り時の再試行もここまで）
+            autosave: path を指定した場合、記録のたびに保存するか（途中で終了しても学習結果を残す）
+
+        同じ path を複数のプロセス（ジョブキューのワーカーなど）で共有する場合、保存時にファイル上の統計へ
+        自分が追加した分だけを合流させるため、ほかのプロセスのサンプルを上書きしない
+        """
+        self.path = path
+        self.autosave = autosave
+        self.window = window
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.floor = floor
+        self.ceiling = ceiling
+
+        # キー → (出力トークン数, 処理時間) のサンプル
+        self.samples: Dict[StatsKey, Deque[Tuple[int, float]]] = {}
+        self.truncations: Dict[StatsKey, int] = {}
+        # 前回の保存以降に追加した分（保存時にファイル上の統計へ合流させる）
+        self._pending_samples: Dict[StatsKey, List[Tuple[int, float]]] = {}
+        self._pending_truncations: Dict[StatsKey, int] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def record(self, problem_type: str, difficulty_level: str, model: str, completion_tokens: int,
+               duration_seconds: float):
+        """打ち切られずに完了した呼び出しの実績を記録"""
+        key = (problem_type, difficulty_level, model)
+        with self._lock:
+            self.samples.setdefault(key, deque(maxlen=self.window)).append((completion_tokens, duration_seconds))
+            self._pending_samples.setdefault(key, []).append((completion_tokens, duration_seconds))
+        self._autosave()
+
+    def record_truncation(self, problem_type: str, difficulty_level: str, model: str):
+        """max_tokens で打ち切られた回数を記録"""
+        key = (problem_type, difficulty_level, model)
+        with self._lock:
+            self.truncations[key] = self.truncations.get(key, 0) + 1
+            self._pending_truncations[key] = self._pending_truncations.get(key, 0) + 1
+        self._autosave()
+
+    def _autosave(self):
+        if self.autosave and self.path is not None:
+            self.save()
+
+    def suggest_max_tokens(self, problem_type: str, difficulty_level: str, model: str) -> Optional[int]:
+        """
+        実績の上位パーセンタイルから max_tokens を決める
+
+        Returns:
+            max_tokens（サンプル不足ならNone＝上限なし）
+        """
+        key = (problem_type, difficulty_level, model)
+        with self._lock:
+            samples = self.samples.get(key)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            tokens = sorted(sample[0] for sample in samples)
+
+        suggested = math.ceil(_percentile(tokens, self.percentile) * self.margin)
+        return min(max(suggested, self.floor), self.ceiling)
+
+    def predict(self, problem_type: str, difficulty_level: str, model: str) -> Dict[str, Any]:
+        """
+        出力トークン数と処理時間の予測
+
+        Returns:
+            expected_completion_tokens: 中央値
+            max_completion_tokens: 設定される max_tokens（サンプル不足ならNone）
+            expected_duration_seconds: 予測処理時間（サンプルがなければNone）
+        """
+        key = (problem_type, difficulty_level, model)
+        with self._lock:
+            samples = list(self.samples.get(key, ()))
+
+        if not samples:
+            return {
+                "sample_count": 0,
+                "expected_completion_tokens": None,
+                "max_completion_tokens": None,
+                "expected_duration_seconds": None
+            }
+
+        expected_tokens = median(sample[0] for sample in samples)
+        return {
+            "sample_count": len(samples),
+            "expected_completion_tokens": expected_tokens,
+            "max_completion_tokens": self.suggest_max_tokens(problem_type, difficulty_level, model),
+            "expected_duration_seconds": median(sample[1] for sample in samples)
+        }
+
+    def save(self, path: Optional[str] = None):
+        """
+        統計をJSONに保存（一時ファイルに書いてから置き換えるため、書き込み途中で壊れない）
+
+        self.path への保存では、ファイル上の統計（ほかのプロセスが保存した分を含む）に前回の保存以降の
+        追加分を合流させ、メモリ上の統計も合流後の内容に更新する。別の path へは現在の統計をそのまま書き出す
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("保存先が指定されていません")
+
+        with self._save_lock:
+            merge = path == self.path and os.path.exists(path)
+            with self._lock:
+                pending_samples, self._pending_samples = self._pending_samples, {}
+                pending_truncations, self._pending_truncations = self._pending_truncations, {}
+                if not merge:
+                    samples = {key: deque(values, maxlen=self.window) for key, values in self.samples.items()}
+                    truncations = dict(self.truncations)
+
+            if merge:
+                samples, truncations = self._read(path)
+                for key, values in pending_samples.items():
+                    samples.setdefault(key, deque(maxlen=self.window)).extend(values)
+                for key, count in pending_truncations.items():
+                    truncations[key] = truncations.get(key, 0) + count
+
+            self._write(path, samples, truncations)
+
+            if merge:
+                with self._lock:
+                    # 書き込み中に追加された分を反映してメモリ上の統計を置き換える
+                    for key, values in self._pending_samples.items():
+                        samples.setdefault(key, deque(maxlen=self.window)).extend(values)
+                    for key, count in self._pending_truncations.items():
+                        truncations[key] = truncations.get(key, 0) + count
+                    self.samples, self.truncations = samples, truncations
+
+    def load(self, path: str):
+        """保存した統計を読み込む"""
+        samples, truncations = self._read(path)
+        with self._lock:
+            self.samples.update(samples)
+            self.truncations.update(truncations)
+
+    def _read(self, path: str) -> Tuple[Dict[StatsKey, Deque[Tuple[int, float]]], Dict[StatsKey, int]]:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        samples = {
+            tuple(item["key"]): deque((tuple(sample) for sample in item["samples"]), maxlen=self.window)
+            for item in data.get("samples", [])
+        }
+        truncations = {tuple(item["key"]): item["count"] for item in data.get("truncations", [])}
+        return samples, truncations
+
+    def _write(self, path: str, samples: Dict[StatsKey, Deque[Tuple[int, float]]], truncations: Dict[StatsKey, int]):
+        data = {
+            "samples": [
+                {"key": list(key), "samples": [list(sample) for sample in values]}
+                for key, values in samples.items()
+            ],
+            "truncations": [{"key": list(key), "count": count} for key, count in truncations.items()]
+        }
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
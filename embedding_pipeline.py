@@ -0,0 +1,309 @@
+"""
+問題インデックス構築用の埋め込みパイプライン
+内容ハッシュで重複・既存分を除き、トークン上限いっぱいのバッチを並列で送信する
+
+使用例:
+    python embedding_pipeline.py problems.txt --output math_index_storage/problem_embeddings
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from enhanced_cost_calculator import enhanced_calculator
+
+DEFAULT_STORE_DIRECTORY = os.path.join("math_index_storage", "problem_embeddings")
+
+# OpenAI Embeddings API の上限
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_TOKENS = 300000
+MAX_BATCH_INPUTS = 2048
+
+
+def content_hash(text: str) -> str:
+    """埋め込みキャッシュのキー（問題文の内容ハッシュ）"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self, directory: str = DEFAULT_STORE_DIRECTORY, model: str = "text-embedding-3-small",
+                 dtype: str = "float16"):
+        """
+        埋め込みの永続キャッシュ
+
+        ファイル構成:
+            meta.json    モデル・次元数・データ型
+            keys.txt     1行1ハッシュ（行番号がベクトルの行）
+            vectors.bin  ベクトルを行順に並べたバイナリ（追記のみ）
+
+        Args:
+            directory: 保存先ディレクトリ
+            model: 埋め込みモデル（既存のストアと異なる場合はエラー）
+            dtype: 保存するデータ型（"float16" または "float32"）
+        """
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.keys_path = os.path.join(directory, "keys.txt")
+        self.vectors_path = os.path.join(directory, "vectors.bin")
+        os.makedirs(directory, exist_ok=True)
+
+        self.meta = {"model": model, "dtype": dtype, "dimensions": None}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+            if self.meta["model"] != model:
+                raise ValueError(f"ストアのモデル {self.meta['model']} と指定のモデル {model} が異なります")
+        self.dtype = np.dtype(self.meta["dtype"])
+
+        self.rows: Dict[str, int] = {}
+        self._load_keys()
+
+    def _load_keys(self):
+        """
+        キーを読み込み、書き込み途中で中断した分を切り詰める
+
+        キーとベクトルの行数が一致しない場合（ベクトルの追記後・キーの追記前に中断した場合など）は、
+        両方に揃っている行までを有効とし、余分な行を削除する（残すと以降の追記で行がずれる）
+        """
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, encoding="utf-8") as f:
+                keys = [line.strip() for line in f if line.strip()]
+
+        # ベクトルが書き込まれた行数までを有効とする
+        complete_rows = 0
+        if self.meta["dimensions"] and os.path.exists(self.vectors_path):
+            row_bytes = self.meta["dimensions"] * self.dtype.itemsize
+            complete_rows = os.path.getsize(self.vectors_path) // row_bytes
+            valid_rows = min(complete_rows, len(keys))
+            if valid_rows * row_bytes != os.path.getsize(self.vectors_path):
+                with open(self.vectors_path, "r+b") as f:
+                    f.truncate(valid_rows * row_bytes)
+
+        if len(keys) > complete_rows:
+            keys = keys[:complete_rows]
+            with open(self.keys_path, "w", encoding="utf-8") as f:
+                f.writelines(key + "\n" for key in keys)
+
+        self.rows = {key: row for row, key in enumerate(keys)}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def append(self, keys: List[str], vectors: np.ndarray):
+        """ベクトルを追記（ベクトル→キーの順に書き込み、中断時も整合性を保つ）"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.meta["dimensions"] is None:
+            self.meta["dimensions"] = int(vectors.shape[1])
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump(self.meta, f)
+        elif vectors.shape[1] != self.meta["dimensions"]:
+            raise ValueError(f"次元数が異なります: {vectors.shape[1]} != {self.meta['dimensions']}")
+
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.astype(self.dtype).tobytes())
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            f.writelines(key + "\n" for key in keys)
+
+        start = len(self.rows)
+        for offset, key in enumerate(keys):
+            self.rows[key] = start + offset
+
+    def vectors(self) -> np.ndarray:
+        """全ベクトルをメモリマップで返す（行番号は self.rows の値）"""
+        if not self.rows:
+            return np.zeros((0, self.meta["dimensions"] or 0), dtype=self.dtype)
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode="r",
+                         shape=(len(self.rows), self.meta["dimensions"]))
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """問題文の埋め込みを取得（未登録ならNone）"""
+        row = self.rows.get(content_hash(text))
+        if row is None:
+            return None
+        return np.asarray(self.vectors()[row], dtype=np.float32)
+
+
+class EmbeddingPipeline:
+    def __init__(self, store: EmbeddingStore, api_key: Optional[str] = None,
+                 base_url: str = "https://api.openai.com/v1", max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 max_batch_inputs: int = MAX_BATCH_INPUTS, max_workers: int = 4, max_retries: int = 3,
+                 calculator=enhanced_calculator):
+        """
+        埋め込みパイプラインの初期化
+
+        Args:
+            store: 埋め込みの保存先
+            api_key: OpenAI APIキー（省略時は環境変数 OPENAI_API_KEY）
+            base_url: APIのベースURL（テスト時はローカルの模擬サーバー）
+            max_batch_tokens: 1リクエストあたりの最大トークン数
+            max_batch_inputs: 1リクエストあたりの最大件数
+            max_workers: 同時に送信するリクエスト数
+            max_retries: レート制限・サーバーエラー時の再試行回数
+            calculator: トークン数・料金の計算に使う EnhancedCostCalculator
+        """
+        self.store = store
+        self.model = store.meta["model"]
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.base_url = base_url.rstrip("/")
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.calculator = calculator
+
+    def _pack_batches(self, texts: Iterable[str], stats: Dict[str, Any]) -> Iterator[List[Tuple[str, str]]]:
+        """未登録の問題文をトークン上限いっぱいのバッチにまとめる"""
+        pending = set()
+        batch: List[Tuple[str, str]] = []
+        batch_tokens = 0
+
+        for text in texts:
+            stats["total"] += 1
+            key = content_hash(text)
+            if key in self.store or key in pending:
+                stats["cached"] += 1
+                continue
+
+            tokens = self.calculator.count_tokens(text, self.model)
+            if tokens > MAX_INPUT_TOKENS:
+                logging.warning(f"入力トークン数が上限を超えたためスキップします: {tokens}トークン")
+                stats["skipped"] += 1
+                continue
+
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.max_batch_inputs):
+                yield batch
+                batch, batch_tokens = [], 0
+
+            pending.add(key)
+            batch.append((key, text))
+            batch_tokens += tokens
+
+        if batch:
+            yield batch
+
+    def _request(self, texts: List[str]) -> Dict[str, Any]:
+        """Embeddings API を呼び出す（429・5xx・接続エラー・タイムアウトは指数バックオフで再試行）"""
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = requests.post(
+                    f"{self.base_url}/embeddings",
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    json={"model": self.model, "input": texts, "encoding_format": "float"},
+                    timeout=120
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt < self.max_retries:
+                    time.sleep(2 ** attempt)
+                    continue
+                raise
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt < self.max_retries:
+                    time.sleep(2 ** attempt)
+                    continue
+            response.raise_for_status()
+
+            data = response.json()
+            data["duration_seconds"] = time.perf_counter() - start
+            return data
+
+    def _store_batch(self, batch: List[Tuple[str, str]], data: Dict[str, Any], stats: Dict[str, Any]):
+        """バッチの結果を保存し、料金を記録"""
+        embeddings = sorted(data["data"], key=lambda item: item["index"])
+        vectors = np.array([item["embedding"] for item in embeddings], dtype=np.float32)
+        self.store.append([key for key, _ in batch], vectors)
+
+        prompt_tokens = data.get("usage", {}).get("prompt_tokens", 0)
+        cost = self.calculator.record_usage(
+            self.model, f"埋め込み({len(batch)}件)", prompt_tokens, duration_seconds=data["duration_seconds"]
+        )
+
+        stats["embedded"] += len(batch)
+        stats["batches"] += 1
+        stats["tokens"] += prompt_tokens
+        stats["cost_jpy"] += cost["total_cost_jpy"]
+        stats["batch_costs"].append({"inputs": len(batch), "tokens": prompt_tokens, "cost_jpy": cost["total_cost_jpy"]})
+
+    def run(self, texts: Iterable[str]) -> Dict[str, Any]:
+        """
+        問題文を順に読み込み、未登録のものだけを埋め込んで保存
+
+        失敗したバッチがあれば新たな送信を止め、送信済みのバッチの結果を保存してから例外を送出する
+        （料金が発生した結果を捨てず、再実行時は失敗・未送信の分だけを送信する）
+
+        Returns:
+            件数・バッチ数・トークン数・料金の集計
+        """
+        stats = {
+            "total": 0, "cached": 0, "skipped": 0, "embedded": 0,
+            "batches": 0, "tokens": 0, "cost_jpy": 0.0, "batch_costs": []
+        }
+
+        errors: List[Exception] = []
+
+        def store(batch: List[Tuple[str, str]], future: Future):
+            try:
+                data = future.result()
+            except Exception as e:
+                errors.append(e)
+                return
+            self._store_batch(batch, data, stats)
+
+        # 送信中のバッチ数を制限し、入力を先読みしすぎないようにする
+        in_flight: List[Tuple[List[Tuple[str, str]], Future]] = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch in self._pack_batches(texts, stats):
+                in_flight.append((batch, executor.submit(self._request, [text for _, text in batch])))
+                if len(in_flight) >= self.max_workers * 2:
+                    store(*in_flight.pop(0))
+                if errors:
+                    break
+
+            for done_batch, future in in_flight:
+                store(done_batch, future)
+
+        if errors:
+            raise errors[0]
+        return stats
+
+
+def main():
+    """コマンドライン実行"""
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="問題インデックスの埋め込みを作成")
+    parser.add_argument("input", help="1行1問の問題ファイル")
+    parser.add_argument("--output", default=DEFAULT_STORE_DIRECTORY, help="保存先ディレクトリ")
+    parser.add_argument("--model", default="text-embedding-3-small")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    parser.add_argument("--base-url", default="https://api.openai.com/v1")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    load_dotenv()
+    store = EmbeddingStore(args.output, args.model, args.dtype)
+    pipeline = EmbeddingPipeline(store, base_url=args.base_url, max_workers=args.workers)
+
+    with open(args.input, encoding="utf-8") as f:
+        stats = pipeline.run(line.strip() for line in f if line.strip())
+
+    print(f"📚 問題数: {stats['total']:,}（キャッシュ済み {stats['cached']:,} / 新規 {stats['embedded']:,} / "
+          f"スキップ {stats['skipped']:,}）")
+    print(f"📦 バッチ数: {stats['batches']:,} / トークン数: {stats['tokens']:,}")
+    print(f"💰 料金: ¥{stats['cost_jpy']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
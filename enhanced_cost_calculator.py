@@ -6,12 +6,14 @@ LangChainのcallbackと手動計算を組み合わせた統合ソリューショ
 import tiktoken
 import requests
 import json
+import threading
 from typing import Dict, List, Optional, Any
-from datetime import datetime
+from datetime import datetime, timedelta
 from contextlib import contextmanager
 from langchain_openai import OpenAI
 from langchain_community.callbacks import get_openai_callback
 import logging
+from tracing import tracer
 
 class EnhancedCostCalculator:
     def __init__(self):
@@ -20,10 +22,12 @@ class EnhancedCostCalculator:
         self.pricing = {
             "gpt-4o-mini": {
                 "input": 0.00015,   # $0.15 per 1M tokens
+                "cached_input": 0.000075,  # $0.075 per 1M tokens（プロンプトキャッシュ）
                 "output": 0.0006    # $0.60 per 1M tokens
             },
             "gpt-4o": {
                 "input": 0.005,     # $5.00 per 1M tokens
+                "cached_input": 0.0025,    # $2.50 per 1M tokens（プロンプトキャッシュ）
                 "output": 0.015     # $15.00 per 1M tokens
             },
             "text-embedding-3-small": {
@@ -39,12 +43,21 @@ class EnhancedCostCalculator:
         # 為替レート（USD/JPY）
         self.exchange_rate = self._get_exchange_rate()
         
+        # 複数スレッドからの統計更新を保護
+        self._stats_lock = threading.Lock()
+        
         # セッション統計（シンプル版）
         self.session_stats = {
             "total_calls": 0,
             "total_tokens": 0,
             "total_cost_usd": 0.0,
-            "total_cost_jpy": 0.0
+            "total_cost_jpy": 0.0,
+            # プロンプトキャッシュが効いた入力トークン数
+            "total_cached_tokens": 0,
+            # 先読み（投機的生成）で使われなかった分の内訳
+            "speculative_calls": 0,
+            "speculative_tokens": 0,
+            "speculative_cost_jpy": 0.0
         }
         
     def _get_exchange_rate(self) -> float:
@@ -105,53 +118,238 @@ class EnhancedCostCalculator:
             "model": model
         }
     
+    def calculate_cost_from_tokens(self, input_tokens: float, output_tokens: float, model: str = "gpt-4o-mini",
+                                   cached_input_tokens: float = 0) -> Dict[str, float]:
+        """
+        トークン数からAPI使用料金を計算（予測値の料金換算などに使用）
+        
+        Args:
+            input_tokens: 入力トークン数（キャッシュ分を含む）
+            output_tokens: 出力トークン数
+            model: モデル名
+            cached_input_tokens: 入力のうちプロンプトキャッシュが効いたトークン数（割引料金）
+        """
+        if model not in self.pricing:
+            logging.warning(f"モデル {model} の料金設定が見つかりません。gpt-4o-miniの料金を使用します。")
+            model = "gpt-4o-mini"
+        
+        pricing = self.pricing[model]
+        cached_price = pricing.get("cached_input", pricing["input"])
+        input_cost_usd = ((input_tokens - cached_input_tokens) / 1000) * pricing["input"] \
+            + (cached_input_tokens / 1000) * cached_price
+        output_cost_usd = (output_tokens / 1000) * pricing["output"]
+        total_cost_usd = input_cost_usd + output_cost_usd
+        
+        return {
+            "input_tokens": input_tokens,
+            "cached_input_tokens": cached_input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_cost_usd": input_cost_usd,
+            "output_cost_usd": output_cost_usd,
+            "total_cost_usd": total_cost_usd,
+            "total_cost_jpy": total_cost_usd * self.exchange_rate,
+            "exchange_rate": self.exchange_rate,
+            "model": model
+        }
+    
+    def callback_cost(self, callback, model: str = "gpt-4o-mini") -> Dict[str, float]:
+        """
+        コールバックの集計からキャッシュ割引を反映した料金を計算
+        
+        料金表にないモデルはコールバックが計算した料金をそのまま使う
+        """
+        # 古いlangchain_communityにはprompt_tokens_cachedがない
+        cached_tokens = getattr(callback, "prompt_tokens_cached", 0) or 0
+        
+        if model in self.pricing:
+            total_cost_usd = self.calculate_cost_from_tokens(
+                callback.prompt_tokens, callback.completion_tokens, model, cached_tokens
+            )["total_cost_usd"]
+        else:
+            total_cost_usd = callback.total_cost
+        
+        return {
+            "cached_prompt_tokens": cached_tokens,
+            "total_cost_usd": total_cost_usd,
+            "total_cost_jpy": total_cost_usd * self.exchange_rate
+        }
+    
+    def calculate_cost_matrix(self, input_tokens, output_tokens, models: Optional[List[str]] = None,
+                              exchange_rates=None, batch_discounts=None, per_record: bool = True) -> Dict[str, Any]:
+        """
+        トークン数の配列を複数モデル・為替レート・バッチ割引で一括計算（NumPy使用）
+        
+        Args:
+            input_tokens: 入力トークン数の配列（N件）
+            output_tokens: 出力トークン数の配列（N件）
+            models: 料金を比較するモデル（省略時は料金表の全モデル）
+            exchange_rates: 為替レートの配列（省略時は現在のレート）
+            batch_discounts: 割引率の配列（0.5なら50%引き、省略時は割引なし）
+            per_record: レコードごとの料金行列を返すか（Falseなら合計のみ）
+        
+        Returns:
+            cost_usd: (モデル数, N) のレコードごとの料金（USD、割引前）
+            total_cost_usd: (モデル数,) の合計料金（USD、割引前）
+            total_cost_jpy: (割引数, 為替レート数, モデル数) の合計料金（JPY）
+        """
+        import numpy as np
+        
+        if models is None:
+            models = list(self.pricing.keys())
+        
+        # 未知のモデルは黙ってgpt-4o-miniに置き換えずエラーにする
+        unknown_models = [model for model in models if model not in self.pricing]
+        if unknown_models:
+            raise ValueError(f"料金設定が見つからないモデルです: {unknown_models}")
+        
+        input_array = np.asarray(input_tokens, dtype=np.float64)
+        output_array = np.asarray(output_tokens, dtype=np.float64)
+        if input_array.ndim != 1 or input_array.shape != output_array.shape:
+            raise ValueError("input_tokens と output_tokens は同じ長さの1次元配列にしてください")
+        
+        rates = np.atleast_1d(np.asarray(
+            self.exchange_rate if exchange_rates is None else exchange_rates, dtype=np.float64
+        ))
+        discounts = np.atleast_1d(np.asarray(
+            0.0 if batch_discounts is None else batch_discounts, dtype=np.float64
+        ))
+        if np.any((discounts < 0.0) | (discounts > 1.0)):
+            raise ValueError("batch_discounts は0〜1の範囲で指定してください")
+        
+        # USD/1000トークン → USD/トークン
+        input_prices = np.array([self.pricing[model]["input"] for model in models]) / 1000
+        output_prices = np.array([self.pricing[model]["output"] for model in models]) / 1000
+        
+        # 合計は行列を作らずにトークン総数から計算
+        total_cost_usd = input_prices * input_array.sum() + output_prices * output_array.sum()
+        total_cost_jpy = (1.0 - discounts)[:, None, None] * rates[None, :, None] * total_cost_usd[None, None, :]
+        
+        result = {
+            "models": list(models),
+            "record_count": int(input_array.size),
+            "total_cost_usd": total_cost_usd,
+            "exchange_rates": rates,
+            "batch_discounts": discounts,
+            "total_cost_jpy": total_cost_jpy
+        }
+        
+        if per_record:
+            result["cost_usd"] = np.outer(input_prices, input_array) + np.outer(output_prices, output_array)
+        
+        return result
+    
     @contextmanager
-    def track_cost(self, model: str = "gpt-4o-mini", operation_name: str = "API呼び出し"):
-        """コスト追跡コンテキストマネージャー"""
+    def track_cost(self, model: str = "gpt-4o-mini", operation_name: str = "API呼び出し", verbose: bool = True):
+        """
+        コスト追跡コンテキストマネージャー
+        
+        Args:
+            model: モデル名
+            operation_name: レポートに表示する操作名
+            verbose: 料金レポートを出力するか
+        """
         start_time = datetime.now()
         
-        with get_openai_callback() as callback:
+        with tracer.span("track_cost", model=model, operation_name=operation_name) as span, \
+                get_openai_callback() as callback:
             try:
                 yield callback
                 
-                # コールバックから取得した情報
-                callback_data = {
-                    "prompt_tokens": callback.prompt_tokens,
-                    "completion_tokens": callback.completion_tokens,
-                    "total_tokens": callback.total_tokens,
-                    "total_cost_usd": callback.total_cost,
-                    "model": model,
-                    "operation_name": operation_name,
-                    "start_time": start_time,
-                    "end_time": datetime.now(),
-                    "duration_seconds": (datetime.now() - start_time).total_seconds()
-                }
-                
-                # JPYでの料金計算
-                callback_data["total_cost_jpy"] = callback.total_cost * self.exchange_rate
-                
-                # セッション統計の更新
-                self._update_session_stats(callback_data)
+                with tracer.span("cost_reporting"):
+                    # キャッシュ割引を反映した料金
+                    cost = self.callback_cost(callback, model)
+                    
+                    # コールバックから取得した情報
+                    callback_data = {
+                        "prompt_tokens": callback.prompt_tokens,
+                        "cached_prompt_tokens": cost["cached_prompt_tokens"],
+                        "completion_tokens": callback.completion_tokens,
+                        "total_tokens": callback.total_tokens,
+                        "total_cost_usd": cost["total_cost_usd"],
+                        "model": model,
+                        "operation_name": operation_name,
+                        "start_time": start_time,
+                        "end_time": datetime.now(),
+                        "duration_seconds": (datetime.now() - start_time).total_seconds()
+                    }
+                    
+                    # JPYでの料金計算
+                    callback_data["total_cost_jpy"] = cost["total_cost_jpy"]
+                    
+                    # セッション統計の更新
+                    self._update_session_stats(callback_data)
+                    
+                    # 詳細レポートの生成
+                    if verbose:
+                        self._print_cost_report(callback_data)
                 
-                # 詳細レポートの生成
-                self._print_cost_report(callback_data)
+                span.set_attribute("prompt_tokens", callback.prompt_tokens)
+                span.set_attribute("completion_tokens", callback.completion_tokens)
+                span.set_attribute("cached_prompt_tokens", callback_data["cached_prompt_tokens"])
+                span.set_attribute("total_cost_usd", callback_data["total_cost_usd"])
                 
             except Exception as e:
                 logging.error(f"コスト追跡中にエラーが発生しました: {e}")
                 raise
     
+    def record_usage(self, model: str, operation_name: str, prompt_tokens: int, completion_tokens: int = 0,
+                     duration_seconds: float = 0.0, verbose: bool = False) -> Dict[str, Any]:
+        """
+        LangChainを経由しないAPI呼び出し（埋め込みなど）の使用量を記録
+        
+        Returns:
+            track_cost と同じ形式の料金データ
+        """
+        cost = self.calculate_cost_from_tokens(prompt_tokens, completion_tokens, model)
+        end_time = datetime.now()
+        
+        callback_data = {
+            "prompt_tokens": prompt_tokens,
+            "cached_prompt_tokens": 0,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "total_cost_usd": cost["total_cost_usd"],
+            "total_cost_jpy": cost["total_cost_jpy"],
+            "model": model,
+            "operation_name": operation_name,
+            "start_time": end_time - timedelta(seconds=duration_seconds),
+            "end_time": end_time,
+            "duration_seconds": duration_seconds
+        }
+        
+        self._update_session_stats(callback_data)
+        if verbose:
+            self._print_cost_report(callback_data)
+        
+        return callback_data
+    
     def _update_session_stats(self, callback_data: Dict[str, Any]):
         """セッション統計を更新（シンプル版）"""
-        self.session_stats["total_calls"] += 1
-        self.session_stats["total_tokens"] += callback_data["total_tokens"]
-        self.session_stats["total_cost_usd"] += callback_data["total_cost_usd"]
-        self.session_stats["total_cost_jpy"] += callback_data["total_cost_jpy"]
+        with self._stats_lock:
+            self.session_stats["total_calls"] += 1
+            self.session_stats["total_tokens"] += callback_data["total_tokens"]
+            self.session_stats["total_cost_usd"] += callback_data["total_cost_usd"]
+            self.session_stats["total_cost_jpy"] += callback_data["total_cost_jpy"]
+            self.session_stats["total_cached_tokens"] += callback_data.get("cached_prompt_tokens", 0)
+    
+    def record_speculative_cost(self, cost_data: Dict[str, Any]):
+        """
+        先読みで生成したが使われなかった結果の料金を記録
+        
+        料金自体はtrack_costで総計に計上済みのため、ここでは内訳のみを加算する
+        """
+        with self._stats_lock:
+            self.session_stats["speculative_calls"] += 1
+            self.session_stats["speculative_tokens"] += cost_data["total_tokens"]
+            self.session_stats["speculative_cost_jpy"] += cost_data["total_cost_jpy"]
     
     def _print_cost_report(self, callback_data: Dict[str, Any]):
         """コストレポートを出力"""
         print(f"\n💰 {callback_data['operation_name']} - 料金レポート")
         print(f"モデル: {callback_data['model']}")
-        print(f"入力トークン数: {callback_data['prompt_tokens']:,}")
+        print(f"入力トークン数: {callback_data['prompt_tokens']:,}"
+              f"（うちキャッシュ: {callback_data.get('cached_prompt_tokens', 0):,}）")
         print(f"出力トークン数: {callback_data['completion_tokens']:,}")
         print(f"合計トークン数: {callback_data['total_tokens']:,}")
         print(f"処理時間: {callback_data['duration_seconds']:.2f}秒")
@@ -195,17 +393,27 @@ class EnhancedCostCalculator:
         print("="*50)
         print(f"総API呼び出し回数: {stats['total_calls']:,}")
         print(f"総トークン数: {stats['total_tokens']:,}")
+        if stats.get("total_cached_tokens"):
+            print(f"キャッシュ済み入力トークン数: {stats['total_cached_tokens']:,}")
         print(f"総料金（JPY）: ¥{stats['total_cost_jpy']:.2f}")
+        if stats.get("speculative_calls"):
+            print(f"うち先読み（未使用）: {stats['speculative_calls']:,}回 / "
+                  f"{stats['speculative_tokens']:,}トークン / ¥{stats['speculative_cost_jpy']:.2f}")
         print("="*50)
     
     def reset_session_stats(self):
         """セッション統計をリセット（シンプル版）"""
-        self.session_stats = {
-            "total_calls": 0,
-            "total_tokens": 0,
-            "total_cost_usd": 0.0,
-            "total_cost_jpy": 0.0
-        }
+        with self._stats_lock:
+            self.session_stats = {
+                "total_calls": 0,
+                "total_tokens": 0,
+                "total_cost_usd": 0.0,
+                "total_cost_jpy": 0.0,
+                "total_cached_tokens": 0,
+                "speculative_calls": 0,
+                "speculative_tokens": 0,
+                "speculative_cost_jpy": 0.0
+            }
         print("🔄 セッション統計をリセットしました。")
 
 # グローバルインスタンス
@@ -7,13 +7,19 @@ import os
 import warnings
 from dotenv import load_dotenv
 from simple_math_generator import SimpleMathProblemGenerator
+from speculative_prefetch import SpeculativePrefetcher
 from enhanced_cost_calculator import print_session_summary, reset_session_stats
 
 # Pydanticの警告を非表示にする
 warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
 
-def main():
-    """メイン実行関数（対話モードのみ）"""
+def main(speculative: bool = False):
+    """
+    メイン実行関数（対話モードのみ）
+    
+    Args:
+        speculative: 問題入力直後に全難易度の生成を先読みするか
+    """
     print("🎓 数学問題類題作成ツール（対話モード）")
     print("="*50)
     
@@ -37,6 +43,11 @@ def main():
     # シンプル版数学問題生成器の初期化
     generator = SimpleMathProblemGenerator(api_key)
     
+    # 先読みモード（オプトイン）
+    prefetcher = SpeculativePrefetcher(generator) if speculative else None
+    if prefetcher:
+        print("⚡ 先読みモード: 問題入力後に全難易度の生成をバックグラウンドで開始します")
+    
     print("✅ 準備完了！以下の操作ができます:")
     print("1. 類題生成")
     print("2. 終了")
@@ -47,9 +58,15 @@ def main():
         
         if choice == "1":
             problem = input("類題を生成したい問題を入力してください: ").strip()
+            if problem and prefetcher:
+                # 難易度の入力を待つ間に全難易度の生成を開始
+                prefetcher.start(problem)
             difficulty = input("難易度を選択してください (初級/中級/上級): ").strip()
             if problem and difficulty:
-                generated = generator.generate_similar_problem(problem, difficulty)
+                if prefetcher:
+                    generated = prefetcher.get(problem, difficulty)
+                else:
+                    generated = generator.generate_similar_problem(problem, difficulty)
                 if "error" not in generated:
                     print("✅ 類題が生成されました:")
                     print("-" * 50)
@@ -60,6 +77,8 @@ def main():
         
         elif choice == "2":
             print("👋 終了します")
+            if prefetcher:
+                prefetcher.close()
             # セッション統計の表示
             print_session_summary()
             break
@@ -69,7 +88,8 @@ def main():
 
 if __name__ == "__main__":
     try:
-        main()
+        # SPECULATIVE_PREFETCH=1 で先読みモードを有効化
+        main(speculative=os.getenv("SPECULATIVE_PREFETCH", "").lower() in ("1", "true", "yes"))
     except KeyboardInterrupt:
         print("\n👋 終了します")
     except Exception as e:
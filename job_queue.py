@@ -0,0 +1,413 @@
+"""
+大量類題生成用のジョブキュー（SQLiteバックエンド）
+複数のワーカープロセスが同じデータベースからタスクを取得して処理する
+
+使用例:
+    python job_queue.py enqueue --db jobs.db --job-id regen --input problems.txt
+    python job_queue.py worker --db jobs.db --job-id regen      # 同じマシン上の複数プロセスで実行
+    python job_queue.py summary --db jobs.db --job-id regen
+    python job_queue.py export --db jobs.db --job-id regen --output results.jsonl
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    problem TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    started_at REAL,
+    completed_at REAL,
+    result TEXT,
+    error TEXT,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_jpy REAL NOT NULL DEFAULT 0.0
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_claim ON tasks (job_id, status, lease_expires);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_unique ON tasks (job_id, problem, difficulty);
+CREATE TABLE IF NOT EXISTS worker_stats (
+    job_id TEXT NOT NULL,
+    worker_id TEXT NOT NULL,
+    tasks_done INTEGER NOT NULL DEFAULT 0,
+    tasks_failed INTEGER NOT NULL DEFAULT 0,
+    session_stats TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, worker_id)
+);
+"""
+
+# ワーカーごとのsession_statsのうち合算する項目
+AGGREGATED_STATS = ["total_calls", "total_tokens", "total_cached_tokens", "total_cost_usd", "total_cost_jpy"]
+
+
+def default_worker_id() -> str:
+    """ホスト名とプロセスIDからワーカーIDを作成"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    def __init__(self, db_path: str, max_attempts: int = 3, journal_mode: str = "WAL"):
+        """
+        ジョブキューの初期化
+
+        Args:
+            db_path: SQLiteデータベースのパス
+            max_attempts: 1タスクあたりの最大試行回数（超えたらfailed）
+            journal_mode: SQLiteのジャーナルモード（WALは同じマシン内のみ。複数台から使う場合は
+                POSIXロックが確実に動作するファイルシステム上で "DELETE" を指定）
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+
+        # 自動コミットにし、取得処理のみ BEGIN IMMEDIATE で排他する
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, job_id: str, problems: Iterable[str], difficulties: List[str],
+                chunk_size: int = 10000) -> int:
+        """
+        問題×難易度のタスクを登録（登録済みの組み合わせは無視するため、中断後の再実行も安全）
+
+        Returns:
+            新たに登録したタスク数
+        """
+        self.conn.execute("INSERT OR IGNORE INTO jobs (job_id, created_at) VALUES (?, ?)", (job_id, time.time()))
+
+        count = 0
+        chunk = []
+        for problem in problems:
+            problem = problem.strip()
+            if not problem:
+                continue
+            chunk.extend((job_id, problem, difficulty) for difficulty in difficulties)
+            if len(chunk) >= chunk_size:
+                count += self._insert_tasks(chunk)
+                chunk = []
+        if chunk:
+            count += self._insert_tasks(chunk)
+        return count
+
+    def _insert_tasks(self, rows: List[tuple]) -> int:
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR IGNORE INTO tasks (job_id, problem, difficulty) VALUES (?, ?, ?)", rows)
+        return self.conn.total_changes - before
+
+    def claim(self, job_id: str, worker_id: str, visibility_timeout: float = 300.0,
+              batch_size: int = 1) -> List[Dict[str, Any]]:
+        """
+        未処理のタスクを取得（取得したタスクは visibility_timeout 秒間ほかのワーカーから見えない）
+
+        期限までに complete/fail されなかったタスク（ワーカーのクラッシュなど）は再びキューに戻る
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+
+            # 期限切れのリースを解放（試行回数を使い切ったものはfailed）
+            self.conn.execute(
+                """UPDATE tasks
+                   SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                       error = CASE WHEN attempts >= ? THEN 'visibility timeout exceeded' ELSE error END,
+                       worker_id = NULL
+                   WHERE job_id = ? AND status = 'leased' AND lease_expires < ?""",
+                (self.max_attempts, self.max_attempts, job_id, now)
+            )
+
+            rows = self.conn.execute(
+                "SELECT * FROM tasks WHERE job_id = ? AND status = 'pending' ORDER BY task_id LIMIT ?",
+                (job_id, batch_size)
+            ).fetchall()
+
+            self.conn.executemany(
+                """UPDATE tasks
+                   SET status = 'leased', attempts = attempts + 1, worker_id = ?, lease_expires = ?,
+                       started_at = COALESCE(started_at, ?)
+                   WHERE task_id = ?""",
+                [(worker_id, now + visibility_timeout, now, row["task_id"]) for row in rows]
+            )
+
+        return [dict(row, attempts=row["attempts"] + 1) for row in rows]
+
+    def extend_leases(self, task_ids: List[int], worker_id: str, visibility_timeout: float = 300.0) -> List[int]:
+        """
+        取得済みタスクのリースを延長（まとめて取得したタスクが処理待ちの間に期限切れにならないように）
+
+        Returns:
+            延長できたタスクID（リースが切れてほかのワーカーに移っていたものは含まない）
+        """
+        expires = time.time() + visibility_timeout
+        extended = []
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for task_id in task_ids:
+                cursor = self.conn.execute(
+                    """UPDATE tasks SET lease_expires = ?
+                       WHERE task_id = ? AND worker_id = ? AND status = 'leased'""",
+                    (expires, task_id, worker_id)
+                )
+                if cursor.rowcount == 1:
+                    extended.append(task_id)
+        return extended
+
+    def complete(self, task_id: int, worker_id: str, result: Dict[str, Any]) -> bool:
+        """
+        タスクを完了にする
+
+        Returns:
+            完了にできたか（リースが切れてほかのワーカーに移っていた場合はFalse）
+        """
+        cost_data = result.get("cost_data", {})
+        cursor = self.conn.execute(
+            """UPDATE tasks
+               SET status = 'done', completed_at = ?, result = ?, error = NULL,
+                   total_tokens = ?, cost_jpy = ?
+               WHERE task_id = ? AND worker_id = ? AND status = 'leased'""",
+            (time.time(), json.dumps(result, ensure_ascii=False),
+             cost_data.get("total_tokens", 0), cost_data.get("total_cost_jpy", 0.0),
+             task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: int, worker_id: str, error: str) -> bool:
+        """タスクを失敗にする（試行回数が残っていればキューに戻す）"""
+        cursor = self.conn.execute(
+            """UPDATE tasks
+               SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                   error = ?, worker_id = NULL, lease_expires = NULL
+               WHERE task_id = ? AND worker_id = ? AND status = 'leased'""",
+            (self.max_attempts, error, task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def report_worker_stats(self, job_id: str, worker_id: str, session_stats: Dict[str, Any],
+                            tasks_done: int, tasks_failed: int, started_at: float):
+        """ワーカーごとのセッション統計を記録"""
+        self.conn.execute(
+            """INSERT INTO worker_stats
+                   (job_id, worker_id, tasks_done, tasks_failed, session_stats, started_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (job_id, worker_id) DO UPDATE SET
+                   tasks_done = excluded.tasks_done,
+                   tasks_failed = excluded.tasks_failed,
+                   session_stats = excluded.session_stats,
+                   updated_at = excluded.updated_at""",
+            (job_id, worker_id, tasks_done, tasks_failed, json.dumps(session_stats), started_at, time.time())
+        )
+
+    def is_finished(self, job_id: str) -> bool:
+        """未処理・処理中のタスクが残っていないか"""
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status IN ('pending', 'leased')", (job_id,)
+        ).fetchone()
+        return row[0] == 0
+
+    def job_summary(self, job_id: str) -> Dict[str, Any]:
+        """ジョブ全体の進捗・料金・スループットを集計"""
+        status_counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        for row in self.conn.execute(
+            "SELECT status, COUNT(*) AS count FROM tasks WHERE job_id = ? GROUP BY status", (job_id,)
+        ):
+            status_counts[row["status"]] = row["count"]
+
+        totals = self.conn.execute(
+            """SELECT COALESCE(SUM(total_tokens), 0) AS tokens, COALESCE(SUM(cost_jpy), 0.0) AS cost_jpy,
+                      MIN(started_at) AS first_started, MAX(completed_at) AS last_completed
+               FROM tasks WHERE job_id = ? AND status = 'done'""",
+            (job_id,)
+        ).fetchone()
+
+        # ワーカーごとのsession_statsを合算
+        aggregated = {key: 0 for key in AGGREGATED_STATS}
+        workers = []
+        for row in self.conn.execute("SELECT * FROM worker_stats WHERE job_id = ?", (job_id,)):
+            stats = json.loads(row["session_stats"])
+            for key in AGGREGATED_STATS:
+                aggregated[key] += stats.get(key, 0)
+            workers.append({
+                "worker_id": row["worker_id"],
+                "tasks_done": row["tasks_done"],
+                "tasks_failed": row["tasks_failed"],
+                "total_cost_jpy": stats.get("total_cost_jpy", 0.0)
+            })
+
+        elapsed = 0.0
+        if totals["first_started"] is not None and totals["last_completed"] is not None:
+            elapsed = max(totals["last_completed"] - totals["first_started"], 0.0)
+
+        return {
+            "job_id": job_id,
+            "status_counts": status_counts,
+            "total_tasks": sum(status_counts.values()),
+            "completed_tokens": totals["tokens"],
+            "completed_cost_jpy": totals["cost_jpy"],
+            "session_stats": aggregated,
+            "workers": workers,
+            "elapsed_seconds": elapsed,
+            "tasks_per_second": status_counts["done"] / elapsed if elapsed > 0 else 0.0
+        }
+
+    def results(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """完了したタスクの結果を順に返す"""
+        for row in self.conn.execute(
+            "SELECT task_id, problem, difficulty, result FROM tasks WHERE job_id = ? AND status = 'done' ORDER BY task_id",
+            (job_id,)
+        ):
+            yield {
+                "task_id": row["task_id"],
+                "problem": row["problem"],
+                "difficulty": row["difficulty"],
+                "result": json.loads(row["result"])
+            }
+
+
+def run_worker(queue: JobQueue, generator, job_id: str, worker_id: Optional[str] = None,
+               visibility_timeout: float = 300.0, batch_size: int = 1, poll_interval: float = 5.0) -> Dict[str, Any]:
+    """
+    キューが空になるまでタスクを処理するワーカー
+
+    Args:
+        queue: JobQueue のインスタンス
+        generator: SimpleMathProblemGenerator のインスタンス
+        job_id: 処理するジョブ
+        worker_id: ワーカーID（省略時はホスト名:プロセスID）
+        visibility_timeout: タスクのリース期間（秒）
+        batch_size: 一度に取得するタスク数
+        poll_interval: ほかのワーカーが処理中のタスクしか残っていない場合の待機間隔（秒）
+    """
+    worker_id = worker_id or default_worker_id()
+    started_at = time.time()
+    baseline = dict(generator.get_session_summary()["session_stats"])
+    tasks_done = 0
+    tasks_failed = 0
+
+    def current_stats() -> Dict[str, Any]:
+        # このワーカーが開始してからの増分のみを記録
+        stats = generator.get_session_summary()["session_stats"]
+        return {key: stats.get(key, 0) - baseline.get(key, 0) for key in AGGREGATED_STATS}
+
+    print(f"👷 ワーカー {worker_id} がジョブ {job_id} の処理を開始します")
+
+    while True:
+        tasks = queue.claim(job_id, worker_id, visibility_timeout, batch_size)
+        if not tasks:
+            if queue.is_finished(job_id):
+                break
+            # 処理中のタスクのリース切れを待つ
+            time.sleep(poll_interval)
+            continue
+
+        for index, task in enumerate(tasks):
+            # 処理前に、このタスクと処理待ちのタスクのリースを延長
+            remaining = [pending["task_id"] for pending in tasks[index:]]
+            if task["task_id"] not in queue.extend_leases(remaining, worker_id, visibility_timeout):
+                continue
+
+            try:
+                result = generator.generate_similar_problem(task["problem"], task["difficulty"], verbose=False)
+            except Exception as e:
+                result = {"error": str(e)}
+
+            # リースがほかのワーカーに移っていた場合は、このワーカーの成功・失敗に数えない
+            if "error" in result:
+                if queue.fail(task["task_id"], worker_id, result["error"]):
+                    tasks_failed += 1
+            elif queue.complete(task["task_id"], worker_id, result):
+                tasks_done += 1
+
+        queue.report_worker_stats(job_id, worker_id, current_stats(), tasks_done, tasks_failed, started_at)
+
+    queue.report_worker_stats(job_id, worker_id, current_stats(), tasks_done, tasks_failed, started_at)
+    print(f"✅ ワーカー {worker_id} 完了 - 成功: {tasks_done}件 / 失敗: {tasks_failed}件")
+
+    return {"worker_id": worker_id, "tasks_done": tasks_done, "tasks_failed": tasks_failed}
+
+
+def print_job_summary(summary: Dict[str, Any]):
+    """ジョブの集計を出力"""
+    counts = summary["status_counts"]
+    print("\n" + "="*50)
+    print(f"📦 ジョブ {summary['job_id']} サマリー")
+    print("="*50)
+    print(f"タスク数: {summary['total_tasks']:,}（完了 {counts['done']:,} / 処理中 {counts['leased']:,} / "
+          f"未処理 {counts['pending']:,} / 失敗 {counts['failed']:,}）")
+    print(f"ワーカー数: {len(summary['workers'])}")
+    print(f"総API呼び出し回数: {summary['session_stats']['total_calls']:,}")
+    print(f"総トークン数: {summary['session_stats']['total_tokens']:,}")
+    print(f"キャッシュ済み入力トークン数: {summary['session_stats']['total_cached_tokens']:,}")
+    print(f"総料金（JPY）: ¥{summary['session_stats']['total_cost_jpy']:.2f}")
+    print(f"スループット: {summary['tasks_per_second']:.2f}件/秒")
+    print("="*50)
+
+
+def main():
+    """コマンドライン実行"""
+    parser = argparse.ArgumentParser(description="類題一括生成ジョブキュー")
+    parser.add_argument("command", choices=["enqueue", "worker", "summary", "export"])
+    parser.add_argument("--db", required=True, help="SQLiteデータベースのパス")
+    parser.add_argument("--job-id", required=True)
+    parser.add_argument("--input", help="enqueue: 1行1問の問題ファイル")
+    parser.add_argument("--difficulties", default="初級,中級,上級", help="enqueue: カンマ区切りの難易度")
+    parser.add_argument("--output", help="export: 出力先（JSON Lines）")
+    parser.add_argument("--visibility-timeout", type=float, default=300.0)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--journal-mode", default="WAL")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db, journal_mode=args.journal_mode)
+
+    if args.command == "enqueue":
+        with open(args.input, encoding="utf-8") as f:
+            count = queue.enqueue(args.job_id, f, args.difficulties.split(","))
+        print(f"📥 {count:,}件のタスクを登録しました")
+
+    elif args.command == "worker":
+        from dotenv import load_dotenv
+        from simple_math_generator import SimpleMathProblemGenerator
+
+        load_dotenv()
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key or api_key == "your-api-key-here":
+            print("❌ APIキーが設定されていません")
+            return
+
+        run_worker(queue, SimpleMathProblemGenerator(api_key), args.job_id,
+                   visibility_timeout=args.visibility_timeout, batch_size=args.batch_size)
+        print_job_summary(queue.job_summary(args.job_id))
+
+    elif args.command == "summary":
+        print_job_summary(queue.job_summary(args.job_id))
+
+    elif args.command == "export":
+        with open(args.output, "w", encoding="utf-8") as f:
+            for record in queue.results(args.job_id):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"📤 {args.output} に出力しました")
+
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+ルールベースのローカル類題生成モジュール
+定型問題（一次方程式・三角形の面積・一次関数・割合）をLLMを使わずに生成
+"""
+
+import random
+import re
+from fractions import Fraction
+from typing import Dict, Any, Optional, Callable
+
+# 難易度ごとの数値範囲
+DIFFICULTY_RANGES = {
+    "初級": (1, 10),
+    "中級": (2, 30),
+    "上級": (5, 99)
+}
+
+# 割合問題で使う「きりのよい」割合
+RATIO_CHOICES = {
+    "初級": ["0.5", "0.2", "0.4", "0.6", "0.8"],
+    "中級": ["0.25", "0.75", "0.3", "0.7", "0.9", "1.2"],
+    "上級": ["0.35", "0.45", "0.65", "0.85", "1.25", "1.4"]
+}
+
+LOCAL_MODEL_NAME = "local-rule"
+
+# テンプレート検出用の正規表現
+# 式の前後に数・文字・演算子が続く場合（2x + 3 = 4x - 5、0.5x、x² など）は対象外にする
+_NOT_PRECEDED = r'(?<![A-Za-z0-9.^=+\-*/])(?<![A-Za-z0-9.^=+\-*/]\s)'
+_NOT_FOLLOWED = r'(?!\s*[A-Za-z0-9.²³^*/×÷=+\-])'
+_NOT_POWER = r'(?![²³^\d])'
+EQUATION_PATTERN = re.compile(
+    _NOT_PRECEDED + r'(\d*)\s*([a-z])' + _NOT_POWER + r'\s*([+\-])\s*(\d+)\s*=\s*(\d+)' + _NOT_FOLLOWED
+)
+TRIANGLE_PATTERN = re.compile(r'底辺が?\s*(\d+)\s*cm.*?高さが?\s*(\d+)\s*cm')
+LINEAR_FUNCTION_PATTERN = re.compile(
+    r'y\s*=\s*(-?\d*)\s*x' + _NOT_POWER + r'\s*(?:([+\-])\s*(\d+))?' + _NOT_FOLLOWED
+)
+X_VALUE_PATTERN = re.compile(r'x\s*=\s*(-?\d+)\s*のとき')
+RATIO_PATTERN = re.compile(r'(\d+)人は(\d+)人の([0-9.]+)にあたります')
+
+
+def _format_term(value: int, variable: str = "") -> str:
+    """符号付きの項を「+ 3x」「- 5」の形式で整形"""
+    sign = "+" if value >= 0 else "-"
+    return f"{sign} {abs(value)}{variable}"
+
+
+def _format_coefficient(value: int, variable: str) -> str:
+    """先頭の係数つき文字を整形（1x→x, -1x→-x）"""
+    if value == 1:
+        return variable
+    if value == -1:
+        return f"-{variable}"
+    return f"{value}{variable}"
+
+
+def _format_content(question: str, answer: str, explanation: str, concepts: str) -> str:
+    """LLMの出力と同じ4要素の形式に整形"""
+    return (
+        f"1. 類題の問題文\n{question}\n\n"
+        f"2. 解答\n{answer}\n\n"
+        f"3. 解説\n{explanation}\n\n"
+        f"4. 使用した数学的概念\n{concepts}"
+    )
+
+
+class LocalProblemGenerator:
+    def __init__(self, seed: Optional[int] = None):
+        """
+        ローカル類題生成器の初期化
+
+        Args:
+            seed: 乱数シード（再現性が必要な場合に指定）
+        """
+        self.random = random.Random(seed)
+
+        # テンプレート名と生成関数の対応（判定順）
+        self.templates: Dict[str, Callable[[re.Match, str, str], Dict[str, str]]] = {
+            "ratio": self._generate_ratio,
+            "triangle_area": self._generate_triangle_area,
+            "linear_function": self._generate_linear_function,
+            "linear_equation": self._generate_linear_equation
+        }
+
+    def detect_template(self, problem_text: str) -> Optional[str]:
+        """問題文が対応しているテンプレート名を返す（対応外ならNone）"""
+        if RATIO_PATTERN.search(problem_text):
+            return "ratio"
+        if "三角形" in problem_text and "面積" in problem_text and TRIANGLE_PATTERN.search(problem_text):
+            return "triangle_area"
+        if LINEAR_FUNCTION_PATTERN.search(problem_text) and X_VALUE_PATTERN.search(problem_text):
+            return "linear_function"
+        if "解きなさい" in problem_text and EQUATION_PATTERN.search(problem_text):
+            # 連立方程式は対象外
+            if len(EQUATION_PATTERN.findall(problem_text)) == 1:
+                return "linear_equation"
+        return None
+
+    def can_handle(self, problem_text: str) -> bool:
+        """ローカル生成が可能か判定"""
+        return self.detect_template(problem_text) is not None
+
+    def generate(self, original_problem: str, difficulty_level: str = "中級") -> Optional[Dict[str, Any]]:
+        """
+        類題をローカルで生成
+
+        Returns:
+            generate_similar_problem と同じ形式の辞書（対応外ならNone）
+        """
+        template = self.detect_template(original_problem)
+        if template is None:
+            return None
+
+        # 未知の難易度は中級の範囲で生成
+        level = difficulty_level if difficulty_level in DIFFICULTY_RANGES else "中級"
+
+        pattern = {
+            "ratio": RATIO_PATTERN,
+            "triangle_area": TRIANGLE_PATTERN,
+            "linear_function": LINEAR_FUNCTION_PATTERN,
+            "linear_equation": EQUATION_PATTERN
+        }[template]
+        match = pattern.search(original_problem)
+        parts = self.templates[template](match, original_problem, level)
+
+        return {
+            "original_problem": original_problem,
+            "difficulty_level": difficulty_level,
+            "generated_content": _format_content(
+                parts["question"], parts["answer"], parts["explanation"], parts["concepts"]
+            ),
+            "generation_prompt": None,
+            "answer": parts["answer"],
+            "generator": "local",
+            "template": template,
+            "cost_data": {
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+                "total_cost_usd": 0.0,
+                "total_cost_jpy": 0.0,
+                "model": LOCAL_MODEL_NAME
+            }
+        }
+
+    def _randint(self, difficulty_level: str, low: Optional[int] = None) -> int:
+        """難易度に応じた範囲の整数を返す"""
+        range_low, range_high = DIFFICULTY_RANGES[difficulty_level]
+        return self.random.randint(low if low is not None else range_low, range_high)
+
+    def _generate_linear_equation(self, match: re.Match, problem_text: str, difficulty_level: str) -> Dict[str, str]:
+        """一次方程式の類題"""
+        variable = match.group(2)
+
+        if difficulty_level == "初級":
+            # x + a = b
+            x = self._randint(difficulty_level)
+            a = self._randint(difficulty_level)
+            b = x + a
+            question = f"{variable} + {a} = {b} を解きなさい。"
+            explanation = f"両辺から{a}を引くと、{variable} = {b} - {a} = {x}"
+        elif difficulty_level == "中級":
+            # ax ± b = c
+            a = self.random.randint(2, 9)
+            x = self.random.randint(1, 15)
+            b = self.random.choice([-1, 1]) * self._randint(difficulty_level)
+            c = a * x + b
+            question = f"{a}{variable} {_format_term(b)} = {c} を解きなさい。"
+            explanation = (
+                f"左辺の{b:+d}を右辺に移項すると、{a}{variable} = {c} {_format_term(-b)} = {c - b}\n"
+                f"両辺を{a}で割ると、{variable} = {x}"
+            )
+        else:
+            # ax + b = cx + d（解が負になることもある）
+            a = self.random.randint(3, 12)
+            c = self.random.randint(1, a - 1)
+            x = self.random.choice([-1, 1]) * self.random.randint(1, 15)
+            b = self.random.choice([-1, 1]) * self._randint(difficulty_level)
+            d = (a - c) * x + b
+            question = (
+                f"{a}{variable} {_format_term(b)} = {_format_coefficient(c, variable)} "
+                f"{_format_term(d)} を解きなさい。"
+            )
+            explanation = (
+                f"{variable}の項を左辺に、数の項を右辺に移項すると、"
+                f"{a}{variable} - {_format_coefficient(c, variable)} = {d} {_format_term(-b)}\n"
+                f"{_format_coefficient(a - c, variable)} = {d - b}"
+            )
+            if a - c != 1:
+                explanation += f"\n両辺を{a - c}で割ると、{variable} = {x}"
+
+        return {
+            "question": question,
+            "answer": f"{variable} = {x}",
+            "explanation": explanation,
+            "concepts": "一次方程式、等式の性質、移項"
+        }
+
+    def _generate_triangle_area(self, match: re.Match, problem_text: str, difficulty_level: str) -> Dict[str, str]:
+        """三角形の面積の類題"""
+        # 面積が整数になるよう底辺は偶数にする
+        base = 2 * self._randint(difficulty_level, 1)
+        height = self._randint(difficulty_level, 2)
+        area = base * height // 2
+
+        if difficulty_level == "上級":
+            # 面積と底辺から高さを求める逆問題
+            question = f"面積が{area}cm²、底辺が{base}cmの三角形の高さを求めなさい。"
+            answer = f"{height}cm"
+            explanation = (
+                f"面積 = 底辺 × 高さ ÷ 2 より、{area} = {base} × 高さ ÷ 2\n"
+                f"高さ = {area} × 2 ÷ {base} = {height}"
+            )
+        else:
+            question = f"三角形の底辺が{base}cm、高さが{height}cmのとき、面積を求めなさい。"
+            answer = f"{area}cm²"
+            explanation = f"面積 = 底辺 × 高さ ÷ 2 = {base} × {height} ÷ 2 = {area}"
+
+        return {
+            "question": question,
+            "answer": answer,
+            "explanation": explanation,
+            "concepts": "三角形の面積の公式"
+        }
+
+    def _generate_linear_function(self, match: re.Match, problem_text: str, difficulty_level: str) -> Dict[str, str]:
+        """一次関数の値を求める類題"""
+        if difficulty_level == "初級":
+            a = self.random.randint(1, 5)
+            b = self.random.randint(1, 10)
+            x = self.random.randint(1, 10)
+        else:
+            a = self.random.choice([-1, 1]) * self.random.randint(2, 9)
+            b = self.random.choice([-1, 1]) * self._randint(difficulty_level)
+            x = self.random.choice([-1, 1]) * self.random.randint(1, 12)
+        y = a * x + b
+
+        equation = f"y = {_format_coefficient(a, 'x')} {_format_term(b)}"
+
+        if difficulty_level == "上級":
+            # yの値からxを求める逆問題
+            question = f"{equation} のグラフについて、y = {y} のときのxの値を求めなさい。"
+            answer = f"x = {x}"
+            explanation = (
+                f"{y} = {a}x {_format_term(b)} より、{a}x = {y - b}\n"
+                f"x = {y - b} ÷ ({a}) = {x}"
+            )
+        else:
+            question = f"{equation} のグラフについて、x = {x} のときのyの値を求めなさい。"
+            answer = f"y = {y}"
+            explanation = f"y = {a} × ({x}) {_format_term(b)} = {a * x} {_format_term(b)} = {y}"
+
+        return {
+            "question": question,
+            "answer": answer,
+            "explanation": explanation,
+            "concepts": "一次関数、代入"
+        }
+
+    def _generate_ratio(self, match: re.Match, problem_text: str, difficulty_level: str) -> Dict[str, str]:
+        """割合（もとにする量・くらべられる量）の多肢選択類題"""
+        ratio_text = self.random.choice(RATIO_CHOICES[difficulty_level])
+        ratio = Fraction(ratio_text)
+
+        # くらべられる量が整数になるよう、もとにする量を割合の分母の倍数にする
+        base = ratio.denominator * self._randint(difficulty_level, 2)
+        if base < 10:
+            base *= 10 // base + 1
+        compared = int(base * ratio)
+
+        labels = ["ア", "イ", "ウ"]
+        values = [f"{compared}人", f"{base}人", ratio_text]
+        self.random.shuffle(values)
+        choice_text = "　".join(f"{label} {value}" for label, value in zip(labels, values))
+        base_label = labels[values.index(f"{base}人")]
+        compared_label = labels[values.index(f"{compared}人")]
+
+        question = (
+            f"次の文を読んで答えましょう。{compared}人は{base}人の{ratio_text}にあたります。\n"
+            f"もとにする量とくらべられる量を、それぞれ選びなさい。\n"
+            f"選択肢: {choice_text}"
+        )
+
+        return {
+            "question": question,
+            "answer": f"もとにする量: {base_label}、くらべられる量: {compared_label}",
+            "explanation": (
+                f"「{compared}人は{base}人の{ratio_text}にあたる」では、基準となる{base}人がもとにする量、"
+                f"比較される{compared}人がくらべられる量です。\n"
+                f"くらべられる量 = もとにする量 × 割合 = {base} × {ratio_text} = {compared}"
+            ),
+            "concepts": "割合、もとにする量、くらべられる量"
+        }
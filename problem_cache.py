@@ -0,0 +1,143 @@
+"""
+問題の骨格をキーにした類題キャッシュ
+数値・文字・人名を抽象化し、数値だけが異なる問題同士で類題を再利用する
+"""
+
+import copy
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Any, List, Optional, Tuple
+
+# 骨格化で置き換えるパターン（指数は次数を区別するため残す）
+SUPERSCRIPT_PATTERN = re.compile(r'[⁰¹²³⁴-⁹]+')
+SUPERSCRIPT_DIGITS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹", "0123456789")
+NUMBER_PATTERN = re.compile(r'(?<![\^\d])\d+(?:\.\d+)?')
+VARIABLE_PATTERN = re.compile(r'(?<![A-Za-z])[a-z](?![A-Za-z])')
+NAME_PATTERN = re.compile(r'[一-鿿ァ-ヶー]{1,4}(さん|くん|君|ちゃん)')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def problem_skeleton(problem_text: str) -> str:
+    """
+    問題文を骨格に変換
+
+    文字は最初に現れた順に v1, v2, … と番号を付ける（与えられた文字と求める文字の区別を残す）
+
+    例: "x + 5 = 12 を解きなさい。" → "v1+#=#を解きなさい。"
+        "x² + 7x + 12 を因数分解しなさい。" → "v1^2+#v1+#を因数分解しなさい。"
+    """
+    # NFKCは上付き数字を通常の数字にするため、先に指数の記法（^n）にそろえる
+    text = SUPERSCRIPT_PATTERN.sub(lambda m: "^" + m.group().translate(SUPERSCRIPT_DIGITS), problem_text)
+    text = unicodedata.normalize("NFKC", text)
+    text = NAME_PATTERN.sub(r'<名>\1', text)
+    text = NUMBER_PATTERN.sub("#", text)
+    variables: Dict[str, str] = {}
+    text = VARIABLE_PATTERN.sub(
+        lambda m: variables.setdefault(m.group(), f"v{len(variables) + 1}"), text
+    )
+    return WHITESPACE_PATTERN.sub("", text)
+
+
+class ProblemCache:
+    def __init__(self, max_age_seconds: Optional[float] = 24 * 60 * 60, max_serves: int = 2,
+                 max_variants_per_key: int = 20):
+        """
+        類題キャッシュの初期化
+
+        Args:
+            max_age_seconds: 類題を再利用できる期間（Noneなら無期限）
+            max_serves: 1つの類題を提供できる回数（生成時の1回を含む）
+            max_variants_per_key: 骨格・難易度ごとに保持する類題の上限
+        """
+        self.max_age_seconds = max_age_seconds
+        self.max_serves = max_serves
+        self.max_variants_per_key = max_variants_per_key
+
+        # (骨格ハッシュ, 難易度) → 類題エントリのリスト
+        self.index: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.stats = {"exact_hits": 0, "skeleton_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def make_key(self, problem_type: str, problem_text: str) -> str:
+        """問題の種類と骨格からハッシュキーを作成"""
+        skeleton = problem_skeleton(problem_text)
+        return hashlib.sha256(f"{problem_type}|{skeleton}".encode("utf-8")).hexdigest()
+
+    def store(self, problem_type: str, problem_text: str, difficulty_level: str, result: Dict[str, Any]):
+        """生成した類題を登録（生成元への提供を1回目として数える）"""
+        key = (self.make_key(problem_type, problem_text), difficulty_level)
+        entry = {
+            "source_problem": problem_text,
+            "result": copy.deepcopy(result),
+            "created_at": time.time(),
+            "serves": 1
+        }
+
+        with self._lock:
+            entries = self.index.setdefault(key, [])
+            entries.append(entry)
+            # 上限を超えたら古いものから削除
+            if len(entries) > self.max_variants_per_key:
+                del entries[:len(entries) - self.max_variants_per_key]
+
+    def lookup(self, problem_type: str, problem_text: str, difficulty_level: str) -> Optional[Dict[str, Any]]:
+        """
+        再利用できる類題を検索
+
+        同じ問題文から生成した類題を優先し、次に提供回数の少ないものを選ぶ
+        """
+        key = (self.make_key(problem_type, problem_text), difficulty_level)
+        now = time.time()
+
+        with self._lock:
+            entries = self.index.get(key)
+            if not entries:
+                self.stats["misses"] += 1
+                return None
+
+            # 期限切れ・提供回数上限のエントリを除外
+            entries[:] = [
+                entry for entry in entries
+                if entry["serves"] < self.max_serves
+                and (self.max_age_seconds is None or now - entry["created_at"] <= self.max_age_seconds)
+            ]
+            if not entries:
+                del self.index[key]
+                self.stats["misses"] += 1
+                return None
+
+            entry = min(entries, key=lambda e: (e["source_problem"] != problem_text, e["serves"]))
+            entry["serves"] += 1
+            hit_type = "exact" if entry["source_problem"] == problem_text else "skeleton"
+            self.stats[f"{hit_type}_hits"] += 1
+
+            result = copy.deepcopy(entry["result"])
+
+        # キャッシュからの提供は料金なし
+        result["original_problem"] = problem_text
+        result["cache_hit"] = hit_type
+        if "cost_data" in result:
+            result["cost_data"] = {
+                **result["cost_data"],
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+                "total_cost_usd": 0.0,
+                "total_cost_jpy": 0.0
+            }
+        return result
+
+    def hit_rate(self) -> float:
+        """キャッシュヒット率"""
+        hits = self.stats["exact_hits"] + self.stats["skeleton_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def clear(self):
+        """キャッシュを空にする"""
+        with self._lock:
+            self.index = {}
+            self.stats = {"exact_hits": 0, "skeleton_hits": 0, "misses": 0}
@@ -7,6 +7,7 @@ import os
 import warnings
 from dotenv import load_dotenv
 from simple_math_generator import SimpleMathProblemGenerator
+from speculative_prefetch import SpeculativePrefetcher
 from enhanced_cost_calculator import print_session_summary, reset_session_stats
 
 # Pydanticの警告を非表示にする
@@ -77,8 +78,13 @@ def main():
     print("\n📊 セッション統計:")
     generator.print_session_summary()
 
-def interactive_mode():
-    """対話モード"""
+def interactive_mode(speculative: bool = False):
+    """
+    対話モード
+    
+    Args:
+        speculative: 問題入力直後に全難易度の生成を先読みするか
+    """
     print("\n🎮 対話モード")
     print("="*30)
     
@@ -92,6 +98,11 @@ def interactive_mode():
     
     generator = SimpleMathProblemGenerator(api_key)
     
+    # 先読みモード（オプトイン）
+    prefetcher = SpeculativePrefetcher(generator) if speculative else None
+    if prefetcher:
+        print("⚡ 先読みモード: 問題入力後に全難易度の生成をバックグラウンドで開始します")
+    
     print("✅ 準備完了！以下の操作ができます:")
     print("1. 類題生成")
     print("2. 終了")
@@ -102,9 +113,15 @@ def interactive_mode():
         
         if choice == "1":
             problem = input("類題を生成したい問題を入力してください: ").strip()
+            if problem and prefetcher:
+                # 難易度の入力を待つ間に全難易度の生成を開始
+                prefetcher.start(problem)
             difficulty = input("難易度を選択してください (初級/中級/上級): ").strip()
             if problem and difficulty:
-                generated = generator.generate_similar_problem(problem, difficulty)
+                if prefetcher:
+                    generated = prefetcher.get(problem, difficulty)
+                else:
+                    generated = generator.generate_similar_problem(problem, difficulty)
                 if "error" not in generated:
                     print("✅ 類題が生成されました:")
                     print("-" * 50)
@@ -115,6 +132,10 @@ def interactive_mode():
         
         elif choice == "2":
             print("👋 終了します")
+            if prefetcher:
+                prefetcher.close()
+                # 先読み分の料金を確認できるようセッション統計を表示
+                print_session_summary()
             break
         
         else:
@@ -130,6 +151,9 @@ if __name__ == "__main__":
         
         mode = input("モードを選択してください (1-2): ").strip()
         
+        # SPECULATIVE_PREFETCH=1 で対話モードの先読みを有効化
+        speculative = os.getenv("SPECULATIVE_PREFETCH", "").lower() in ("1", "true", "yes")
+        
         if mode == "1":
             # メイン実行（デモ）
             main()
@@ -137,10 +161,10 @@ if __name__ == "__main__":
             print("\n" + "="*50)
             use_interactive = input("対話モードを使用しますか？ (y/n): ").strip().lower()
             if use_interactive == 'y':
-                interactive_mode()
+                interactive_mode(speculative)
         elif mode == "2":
             # 対話モードのみ
-            interactive_mode()
+            interactive_mode(speculative)
         else:
             print("❌ 無効な選択です")
         
@@ -4,9 +4,16 @@
 """
 
 import os
+import re
+import time
 import warnings
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Set
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
+from local_problem_generator import LocalProblemGenerator
+from problem_cache import ProblemCache
+from completion_stats import CompletionLengthStats
+from tracing import tracer
 from enhanced_cost_calculator import (
     enhanced_calculator,
     print_session_summary,
@@ -16,19 +23,76 @@ from enhanced_cost_calculator import (
 # Pydanticの警告を非表示にする
 warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
 
+# 類題生成プロンプトの固定部分（すべての問題で共通の先頭部分）
+PROMPT_PREFIX = """あなたは中学数学の問題作成者です。
+ユーザーが示す元の問題を参考にして、指定された難易度（初級・中級・上級）の類題を作成してください。
+類題は元の問題と同じ解法パターンを使うものにしてください。"""
+
+# 問題の種類ごとの固定の指示
+GENERAL_INSTRUCTIONS = """以下の形式で回答してください：
+1. 類題の問題文
+2. 解答
+3. 解説
+4. 使用した数学的概念
+
+数値は適切に変更し、同じ解法パターンを使う類題を作成してください。
+計算が必要な場合は、正確な数値を計算して示してください。"""
+
+GENERAL_MULTIPLE_CHOICE_INSTRUCTIONS = """以下の形式で回答してください：
+1. 類題の問題文（選択肢を含む）
+2. 正解（選択肢の記号のみ）
+3. 解説（なぜその選択肢が正解なのか）
+4. 使用した数学的概念
+
+重要：
+- 選択肢は問題文に含めてください
+- 解答では選択肢の記号（ア、イ、ウ、エなど）のみを答えてください
+- 選択肢の内容は適切に変更し、同じ解法パターンを使う類題を作成してください
+- 数値は適切に変更してください"""
+
+RATIO_MULTIPLE_CHOICE_INSTRUCTIONS = """【類題作成指示】
+以下の形式で回答してください：
+1. 類題の問題文（選択肢を含む）
+2. 正解（選択肢の記号のみ）
+3. 解説（なぜその選択肢が正解なのか）
+4. 使用した数学的概念
+
+【重要】
+- 数値は適切に変更してください（例：64→45、80→60、0.8→0.75など）
+- 選択肢の構造は元の問題と同じにしてください
+- もとにする量の選択肢とくらべられる量の選択肢を明確に分けて提示してください
+- 各選択肢は「ア」「イ」「ウ」「エ」で区別してください
+- 正解は選択肢の記号のみで答えてください"""
+
 class SimpleMathProblemGenerator:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, use_local_generator: bool = True, use_cache: bool = False,
+                 adaptive_max_tokens: bool = True):
         """
         シンプル版数学問題生成器の初期化
         
         Args:
             api_key: OpenAI APIキー
+            use_local_generator: 定型問題をローカル（API呼び出しなし）で生成するか
+            use_cache: 数値だけが異なる問題の類題を再利用するか
+            adaptive_max_tokens: 過去の出力トークン数から max_tokens を設定するか
         """
         # OpenAI APIキーの設定
         os.environ["OPENAI_API_KEY"] = api_key
         
         # LLMの設定
         self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7)
+        
+        # 定型問題用のローカル生成器（対応外の問題のみLLMを使用）
+        self.local_generator = LocalProblemGenerator() if use_local_generator else None
+        
+        # 問題の骨格（数値・文字・人名を抽象化）をキーにした類題キャッシュ
+        # 鮮度・再利用回数の方針を変える場合は ProblemCache(...) を直接代入する
+        self.cache = ProblemCache() if use_cache else None
+        
+        # (問題の種類, 難易度, モデル) ごとの出力トークン数の実績
+        # 環境変数 MATH_COMPLETION_STATS_FILE を設定すると、そのファイルに保存し次回起動時に読み込む
+        self.completion_stats = CompletionLengthStats(os.getenv("MATH_COMPLETION_STATS_FILE"))
+        self.adaptive_max_tokens = adaptive_max_tokens
     
     def _parse_multiple_choice_problem(self, problem_text: str) -> Dict[str, Any]:
         """多肢選択問題を構造化して解析"""
@@ -72,10 +136,26 @@ class SimpleMathProblemGenerator:
             "correct_answer": None
         }
         
-    def generate_similar_problem(self, original_problem: str, difficulty_level: str = "中級") -> Dict[str, Any]:
-        """類題の生成"""
+    def _is_multiple_choice(self, problem_text: str) -> bool:
+        """多肢選択問題かどうかを判定"""
+        return any(keyword in problem_text for keyword in ["選択肢", "ア", "イ", "ウ", "エ", "A", "B", "C", "D", "/", "もとにする量", "くらべられる量"])
+    
+    def _detect_problem_type(self, problem_text: str) -> str:
+        """問題の種類を判定（ratio_multiple_choice / general_multiple_choice / general）"""
+        if self._is_multiple_choice(problem_text):
+            return self._parse_multiple_choice_problem(problem_text)["type"]
+        return "general"
+    
+    def _build_prompt(self, original_problem: str, difficulty_level: str) -> List[BaseMessage]:
+        """
+        問題の種類に応じた類題生成プロンプトを作成
+        
+        プロバイダ側のプロンプトキャッシュが効くよう、固定の指示をシステムメッセージ（先頭）に、
+        元の問題・難易度などの可変部分をユーザーメッセージ（末尾）に置く
+        （OpenAIのキャッシュは1024トークン以上の入力が対象のため、現在の固定部分の長さでは適用されない）
+        """
         # 多肢選択問題かどうかを判定
-        is_multiple_choice = any(keyword in original_problem for keyword in ["選択肢", "ア", "イ", "ウ", "エ", "A", "B", "C", "D", "/", "もとにする量", "くらべられる量"])
+        is_multiple_choice = self._is_multiple_choice(original_problem)
         
         if is_multiple_choice:
             # 選択肢を構造化して解析
@@ -83,94 +163,334 @@ class SimpleMathProblemGenerator:
             
             if structured_problem["type"] == "ratio_multiple_choice":
                 # 比率問題用の構造化プロンプト
-                prompt = f"""
-                以下の中学数学問題を参考にして、{difficulty_level}レベルの多肢選択類題を作成してください。
-                
-                【元の問題の構造化情報】
-                問題文: {structured_problem["question"]}
-                もとにする量の選択肢: {structured_problem["base_choices"]}
-                くらべられる量の選択肢: {structured_problem["compared_choices"]}
-                正解: もとにする量={structured_problem["correct_answer"]["base"]}, くらべられる量={structured_problem["correct_answer"]["compared"]}
-                
-                【類題作成指示】
-                以下の形式で回答してください：
-                1. 類題の問題文（選択肢を含む）
-                2. 正解（選択肢の記号のみ）
-                3. 解説（なぜその選択肢が正解なのか）
-                4. 使用した数学的概念
-                
-                【重要】
-                - 数値は適切に変更してください（例：64→45、80→60、0.8→0.75など）
-                - 選択肢の構造は元の問題と同じにしてください
-                - もとにする量の選択肢とくらべられる量の選択肢を明確に分けて提示してください
-                - 各選択肢は「ア」「イ」「ウ」「エ」で区別してください
-                - 正解は選択肢の記号のみで答えてください
-                """
+                instructions = RATIO_MULTIPLE_CHOICE_INSTRUCTIONS
+                request = (
+                    f"以下の中学数学問題を参考にして、{difficulty_level}レベルの多肢選択類題を作成してください。\n\n"
+                    f"【元の問題の構造化情報】\n"
+                    f"問題文: {structured_problem['question']}\n"
+                    f"もとにする量の選択肢: {structured_problem['base_choices']}\n"
+                    f"くらべられる量の選択肢: {structured_problem['compared_choices']}\n"
+                    f"正解: もとにする量={structured_problem['correct_answer']['base']}, "
+                    f"くらべられる量={structured_problem['correct_answer']['compared']}"
+                )
             else:
                 # 一般的な多肢選択問題用のプロンプト
-                prompt = f"""
-                以下の中学数学問題を参考にして、{difficulty_level}レベルの多肢選択類題を作成してください。
-                
-                元の問題: {original_problem}
-                
-                以下の形式で回答してください：
-                1. 類題の問題文（選択肢を含む）
-                2. 正解（選択肢の記号のみ）
-                3. 解説（なぜその選択肢が正解なのか）
-                4. 使用した数学的概念
-                
-                重要：
-                - 選択肢は問題文に含めてください
-                - 解答では選択肢の記号（ア、イ、ウ、エなど）のみを答えてください
-                - 選択肢の内容は適切に変更し、同じ解法パターンを使う類題を作成してください
-                - 数値は適切に変更してください
-                """
+                instructions = GENERAL_MULTIPLE_CHOICE_INSTRUCTIONS
+                request = (
+                    f"以下の中学数学問題を参考にして、{difficulty_level}レベルの多肢選択類題を作成してください。\n\n"
+                    f"元の問題: {original_problem}"
+                )
         else:
             # 通常の問題用のプロンプト
-            prompt = f"""
-            以下の中学数学問題を参考にして、{difficulty_level}レベルの類題を作成してください。
-            
-            元の問題: {original_problem}
-            
-            以下の形式で回答してください：
-            1. 類題の問題文
-            2. 解答
-            3. 解説
-            4. 使用した数学的概念
-            
-            数値は適切に変更し、同じ解法パターンを使う類題を作成してください。
-            計算が必要な場合は、正確な数値を計算して示してください。
-            """
+            instructions = GENERAL_INSTRUCTIONS
+            request = (
+                f"以下の中学数学問題を参考にして、{difficulty_level}レベルの類題を作成してください。\n\n"
+                f"元の問題: {original_problem}"
+            )
+        
+        return [
+            SystemMessage(content=f"{PROMPT_PREFIX}\n\n{instructions}"),
+            HumanMessage(content=request)
+        ]
+    
+    def _prompt_text(self, messages: List[BaseMessage]) -> str:
+        """プロンプトを記録・トークン計算用の文字列に変換"""
+        return "\n\n".join(message.content for message in messages)
+    
+    def generate_similar_problem(self, original_problem: str, difficulty_level: str = "中級", verbose: bool = True,
+                                 profile: bool = False) -> Dict[str, Any]:
+        """
+        類題の生成
+        
+        Args:
+            original_problem: 元の問題
+            difficulty_level: 難易度
+            verbose: 料金レポートを出力するか（バックグラウンド生成時はFalse）
+            profile: このリクエストをサンプリングプロファイラで計測するか
+        """
+        with tracer.span("generate_similar_problem", profile=profile, difficulty_level=difficulty_level,
+                         problem_length=len(original_problem)) as span:
+            result = self._generate_similar_problem(original_problem, difficulty_level, verbose)
+            span.set_attribute("source", result.get("cache_hit") or result.get("generator") or "llm")
+            return result
+    
+    def _generate_similar_problem(self, original_problem: str, difficulty_level: str, verbose: bool) -> Dict[str, Any]:
+        """類題の生成（フェーズごとにスパンを記録）"""
+        # 定型問題はローカルで生成（料金なし）
+        if self.local_generator is not None:
+            with tracer.span("local_generation"):
+                local_result = self.local_generator.generate(original_problem, difficulty_level)
+            if local_result is not None:
+                return local_result
+        
+        # 骨格が同じ問題の類題がキャッシュにあれば再利用
+        with tracer.span("classify"):
+            problem_type = self._detect_problem_type(original_problem)
+        if self.cache is not None:
+            with tracer.span("cache_lookup"):
+                cached_result = self.cache.lookup(problem_type, original_problem, difficulty_level)
+            if cached_result is not None:
+                return cached_result
+        
+        with tracer.span("build_prompt"):
+            prompt = self._build_prompt(original_problem, difficulty_level)
         
         try:
             # 改良版のコスト追跡を使用
-            with enhanced_calculator.track_cost("gpt-4o-mini", f"類題生成({difficulty_level})") as callback:
-                response = self.llm.invoke(prompt)
+            with enhanced_calculator.track_cost("gpt-4o-mini", f"類題生成({difficulty_level})", verbose=verbose) as callback:
+                response, max_tokens, truncation_retries, truncated = self._invoke_with_adaptive_limit(
+                    prompt, problem_type, difficulty_level
+                )
+                
+                # キャッシュ割引を反映した料金
+                cost = enhanced_calculator.callback_cost(callback, "gpt-4o-mini")
                 
                 # 結果を構造化
                 generated_problem = {
                     "original_problem": original_problem,
                     "difficulty_level": difficulty_level,
                     "generated_content": response.content,
-                    "generation_prompt": prompt,
+                    "generation_prompt": self._prompt_text(prompt),
                     "cost_data": {
                         "prompt_tokens": callback.prompt_tokens,
+                        "cached_prompt_tokens": cost["cached_prompt_tokens"],
                         "completion_tokens": callback.completion_tokens,
                         "total_tokens": callback.total_tokens,
-                        "total_cost_usd": callback.total_cost,
-                        "total_cost_jpy": callback.total_cost * enhanced_calculator.exchange_rate,
-                        "model": "gpt-4o-mini"
-                    }
+                        "total_cost_usd": cost["total_cost_usd"],
+                        "total_cost_jpy": cost["total_cost_jpy"],
+                        "model": "gpt-4o-mini",
+                        "max_tokens": max_tokens,
+                        "truncation_retries": truncation_retries
+                    },
+                    # 上限まで広げても出力が打ち切られた（解答・解説が欠けている可能性がある）
+                    "truncated": truncated
                 }
                 
+                if truncated:
+                    if verbose:
+                        print(f"⚠️ 出力が max_tokens（{max_tokens or 'モデルの上限'}）で打ち切られました")
+                elif self.cache is not None:
+                    # 打ち切られた類題は再利用しない
+                    self.cache.store(problem_type, original_problem, difficulty_level, generated_problem)
+                
                 return generated_problem
                 
         except Exception as e:
             print(f"類題生成中にエラーが発生しました: {e}")
             return {"error": str(e)}
     
-    def generate_multiple_problems(self, original_problem: str, difficulties: list = ["初級", "中級", "上級"]) -> Dict[str, Any]:
+    def _invoke_with_adaptive_limit(self, prompt, problem_type: str, difficulty_level: str):
+        """
+        学習した max_tokens でLLMを呼び出し、打ち切られた場合は上限を広げて再試行
+        
+        Returns:
+            (応答, 最後に使った max_tokens, 再試行回数, 上限でも打ち切られたか)
+        """
+        stats = self.completion_stats
+        max_tokens = stats.suggest_max_tokens(problem_type, difficulty_level, "gpt-4o-mini") if self.adaptive_max_tokens else None
+        retries = 0
+        
+        while True:
+            llm = self.llm.bind(max_tokens=max_tokens) if max_tokens else self.llm
+            start = time.perf_counter()
+            with tracer.span("llm_invoke", model="gpt-4o-mini", max_tokens=max_tokens or 0):
+                response = llm.invoke(prompt)
+            duration = time.perf_counter() - start
+            
+            truncated = response.response_metadata.get("finish_reason") == "length"
+            if truncated and max_tokens and max_tokens < stats.ceiling:
+                stats.record_truncation(problem_type, difficulty_level, "gpt-4o-mini")
+                max_tokens = min(max_tokens * 2, stats.ceiling)
+                retries += 1
+                continue
+            break
+        
+        if truncated:
+            stats.record_truncation(problem_type, difficulty_level, "gpt-4o-mini")
+        else:
+            usage = response.usage_metadata or {}
+            completion_tokens = usage.get("output_tokens") or enhanced_calculator.count_tokens(response.content)
+            stats.record(problem_type, difficulty_level, "gpt-4o-mini", completion_tokens, duration)
+        
+        return response, max_tokens, retries, truncated
+    
+    def predict_request(self, original_problem: str, difficulty_level: str = "中級") -> Dict[str, Any]:
+        """
+        リクエストの料金・処理時間を実行前に予測（スケジューラや予算管理用）
+        
+        Returns:
+            source: "local"（ローカル生成・料金なし）または "llm"
+            expected_cost_jpy / max_cost_jpy: 出力トークンの中央値・max_tokens での料金
+            expected_duration_seconds: 処理時間の中央値（実績がなければNone）
+        """
+        if self.local_generator is not None and self.local_generator.can_handle(original_problem):
+            return {
+                "source": "local",
+                "prompt_tokens": 0,
+                "expected_completion_tokens": 0,
+                "max_completion_tokens": 0,
+                "expected_cost_jpy": 0.0,
+                "max_cost_jpy": 0.0,
+                "expected_duration_seconds": 0.0
+            }
+        
+        problem_type = self._detect_problem_type(original_problem)
+        prompt_tokens = enhanced_calculator.count_tokens(
+            self._prompt_text(self._build_prompt(original_problem, difficulty_level))
+        )
+        prediction = self.completion_stats.predict(problem_type, difficulty_level, "gpt-4o-mini")
+        
+        expected_tokens = prediction["expected_completion_tokens"]
+        max_tokens = prediction["max_completion_tokens"]
+        
+        return {
+            "source": "llm",
+            "problem_type": problem_type,
+            "sample_count": prediction["sample_count"],
+            "prompt_tokens": prompt_tokens,
+            "expected_completion_tokens": expected_tokens,
+            "max_completion_tokens": max_tokens,
+            "expected_cost_jpy": enhanced_calculator.calculate_cost_from_tokens(
+                prompt_tokens, expected_tokens, "gpt-4o-mini"
+            )["total_cost_jpy"] if expected_tokens is not None else None,
+            "max_cost_jpy": enhanced_calculator.calculate_cost_from_tokens(
+                prompt_tokens, max_tokens, "gpt-4o-mini"
+            )["total_cost_jpy"] if max_tokens is not None else None,
+            "expected_duration_seconds": prediction["expected_duration_seconds"]
+        }
+    
+    def _variant_key(self, content: str) -> str:
+        """重複判定用のキー（問題文部分から空白を除いたもの）"""
+        # 「2.」以降（解答・解説）は表現の揺れが大きいため問題文部分のみで比較
+        question = re.split(r'\n\s*(?:\*\*)?2[.．]', content, maxsplit=1)[0]
+        return re.sub(r'\s+', '', question)
+    
+    def _split_batch_cost(self, callback, completion_texts: List[str]) -> List[Dict[str, Any]]:
+        """一括生成のコールバック合計を類題ごとの料金に按分"""
+        count = len(completion_texts)
+        
+        # 出力トークンは各類題の長さに比例して按分
+        lengths = [enhanced_calculator.count_tokens(text) for text in completion_texts]
+        total_length = sum(lengths) or 1
+        completion_shares = [callback.completion_tokens * length / total_length for length in lengths]
+        
+        # 入力トークン（共有プロンプト、キャッシュ分を含む）は均等に按分
+        prompt_share = callback.prompt_tokens / count
+        cached_share = enhanced_calculator.callback_cost(callback, "gpt-4o-mini")["cached_prompt_tokens"] / count
+        
+        cost_data_list = []
+        for completion_share in completion_shares:
+            cost = enhanced_calculator.calculate_cost_from_tokens(
+                prompt_share, completion_share, "gpt-4o-mini", cached_share
+            )
+            cost_data_list.append({
+                "prompt_tokens": prompt_share,
+                "cached_prompt_tokens": cached_share,
+                "completion_tokens": completion_share,
+                "total_tokens": prompt_share + completion_share,
+                "total_cost_usd": cost["total_cost_usd"],
+                "total_cost_jpy": cost["total_cost_jpy"],
+                "model": "gpt-4o-mini"
+            })
+        
+        return cost_data_list
+    
+    def generate_variants(self, original_problem: str, difficulty_level: str = "中級", k: int = 5,
+                          dedup: bool = True, max_rounds: int = 3, verbose: bool = True,
+                          exclude: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """
+        1回のリクエストでk個の類題を生成（入力トークンをk個の類題で共有）
+        
+        Args:
+            original_problem: 元の問題
+            difficulty_level: 難易度
+            k: 生成する類題の数
+            dedup: 重複する類題を除外し、不足分を再リクエストするか
+            max_rounds: 重複除外時の最大リクエスト回数
+            verbose: 料金レポートを出力するか（バックグラウンド生成時はFalse）
+            exclude: 重複として扱う既存の類題のキー（_variant_key の値。提供済みの類題など）
+        """
+        variants = []
+        seen = set(exclude or ())
+        total_cost = 0.0
+        duplicates = 0
+        rounds = 0
+        
+        def add_variant(variant: Dict[str, Any]):
+            nonlocal duplicates
+            key = self._variant_key(variant["generated_content"])
+            if dedup and key in seen:
+                duplicates += 1
+                return
+            seen.add(key)
+            variants.append(variant)
+        
+        # 定型問題はローカルで生成（料金なし）
+        if self.local_generator is not None and self.local_generator.can_handle(original_problem):
+            while len(variants) < k and rounds < k * max_rounds:
+                rounds += 1
+                add_variant(self.local_generator.generate(original_problem, difficulty_level))
+            
+            return {
+                "variants": variants,
+                "total_cost_jpy": 0.0,
+                "requested": k,
+                "rounds": rounds,
+                "duplicates": duplicates
+            }
+        
+        prompt = self._build_prompt(original_problem, difficulty_level)
+        
+        try:
+            while len(variants) < k and rounds < max_rounds:
+                rounds += 1
+                n = k - len(variants)
+                
+                with enhanced_calculator.track_cost("gpt-4o-mini", f"類題一括生成({difficulty_level}×{n})", verbose=verbose) as callback:
+                    # n個の補完を1リクエストで取得
+                    response = self.llm.generate([prompt], n=n)
+                    generations = response.generations[0]
+                
+                total_cost += enhanced_calculator.callback_cost(callback, "gpt-4o-mini")["total_cost_jpy"]
+                contents = [generation.text for generation in generations]
+                
+                for content, cost_data in zip(contents, self._split_batch_cost(callback, contents)):
+                    add_variant({
+                        "original_problem": original_problem,
+                        "difficulty_level": difficulty_level,
+                        "generated_content": content,
+                        "generation_prompt": self._prompt_text(prompt),
+                        "cost_data": cost_data
+                    })
+                
+                if not dedup:
+                    break
+            
+            if self.cache is not None:
+                problem_type = self._detect_problem_type(original_problem)
+                for variant in variants[:k]:
+                    self.cache.store(problem_type, original_problem, difficulty_level, variant)
+            
+            return {
+                "variants": variants[:k],
+                "total_cost_jpy": total_cost,
+                "requested": k,
+                "rounds": rounds,
+                "duplicates": duplicates
+            }
+            
+        except Exception as e:
+            print(f"類題一括生成中にエラーが発生しました: {e}")
+            return {"error": str(e)}
+    
+    def generate_multiple_problems(self, original_problem: str, difficulties: list = ["初級", "中級", "上級"],
+                                   profile: bool = False) -> Dict[str, Any]:
         """複数の難易度で類題を生成"""
+        with tracer.span("generate_multiple_problems", profile=profile, difficulties=",".join(difficulties)):
+            return self._generate_multiple_problems(original_problem, difficulties)
+    
+    def _generate_multiple_problems(self, original_problem: str, difficulties: list) -> Dict[str, Any]:
+        """複数の難易度で類題を生成（トレース用の本体）"""
         results = {}
         total_cost = 0.0
         
@@ -0,0 +1,98 @@
+"""
+対話モード用の先読み（投機的生成）モジュール
+問題が入力された時点で全難易度の類題生成をバックグラウンドで開始する
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional
+from enhanced_cost_calculator import enhanced_calculator
+
+DEFAULT_DIFFICULTIES = ("初級", "中級", "上級")
+
+
+class SpeculativePrefetcher:
+    def __init__(self, generator, difficulties: tuple = DEFAULT_DIFFICULTIES):
+        """
+        先読み生成器の初期化
+
+        Args:
+            generator: SimpleMathProblemGenerator のインスタンス
+            difficulties: 先読みする難易度
+        """
+        self.generator = generator
+        self.difficulties = difficulties
+        self.executor = ThreadPoolExecutor(max_workers=len(difficulties), thread_name_prefix="prefetch")
+
+        # 現在先読み中の問題と、難易度ごとの生成結果（未提供分のみ保持）
+        self.current_problem: Optional[str] = None
+        self.futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def start(self, problem: str):
+        """問題が入力された時点で全難易度の生成を開始"""
+        with self._lock:
+            if problem == self.current_problem:
+                return
+
+            self._discard_locked()
+            self.current_problem = problem
+
+            # 定型問題はローカル生成で即座に返るため先読み不要
+            local_generator = self.generator.local_generator
+            if local_generator is not None and local_generator.can_handle(problem):
+                return
+
+            for difficulty in self.difficulties:
+                self.futures[difficulty] = self.executor.submit(
+                    self.generator.generate_similar_problem, problem, difficulty, False
+                )
+
+    def get(self, problem: str, difficulty: str) -> Dict[str, Any]:
+        """
+        選択された難易度の類題を返す
+
+        先読み済みならその結果を、そうでなければ通常どおり生成する
+        """
+        with self._lock:
+            future = self.futures.pop(difficulty, None) if problem == self.current_problem else None
+
+        if future is None:
+            return self.generator.generate_similar_problem(problem, difficulty)
+
+        result = future.result()
+        if "cost_data" in result and result["cost_data"]["total_tokens"]:
+            print(f"⚡ 先読み済みの類題を表示します（料金: ¥{result['cost_data']['total_cost_jpy']:.4f}）")
+        return result
+
+    def discard(self):
+        """未提供の先読み結果を破棄し、料金を先読み分として記録"""
+        with self._lock:
+            self._discard_locked()
+
+    def close(self):
+        """
+        先読みを終了（未開始の生成はキャンセル）
+
+        実行中の生成は完了を待ち、先読み分の料金を記録してから戻る
+        （終了時のセッション統計に含めるため）
+        """
+        self.discard()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _discard_locked(self):
+        for future in self.futures.values():
+            # 未開始ならキャンセルして料金は発生しない
+            if not future.cancel():
+                future.add_done_callback(_record_unused_result)
+        self.futures = {}
+        self.current_problem = None
+
+
+def _record_unused_result(future: Future):
+    """使われなかった先読み結果の料金をセッション統計に記録"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if "cost_data" in result:
+        enhanced_calculator.record_speculative_cost(result["cost_data"])
@@ -0,0 +1,148 @@
+"""
+出力トークン統計（max_tokens の学習）のテスト
+APIキーなしで動作（LLMは模擬チャットモデル）
+"""
+
+import json
+import os
+import tempfile
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from completion_stats import CompletionLengthStats
+from problem_cache import ProblemCache
+from simple_math_generator import SimpleMathProblemGenerator
+
+KEY = ("general", "中級", "gpt-4o-mini")
+PROBLEM = "半径が6cmの円の面積を求めなさい。"
+
+
+def test_suggest_max_tokens():
+    """サンプルが揃うまでは上限なし、その後はパーセンタイル×余裕分（下限・上限つき）"""
+    stats = CompletionLengthStats(min_samples=20, percentile=95.0, margin=1.2, floor=256, ceiling=4096)
+    for tokens in range(1, 20):
+        stats.record(*KEY, tokens * 50, 1.0)
+    assert stats.suggest_max_tokens(*KEY) is None
+
+    stats.record(*KEY, 1000, 1.0)
+    # 20件（50〜950, 1000）の95パーセンタイルは950
+    assert stats.suggest_max_tokens(*KEY) == 1140
+    # 別のキーは独立
+    assert stats.suggest_max_tokens("general", "上級", "gpt-4o-mini") is None
+
+    small = CompletionLengthStats(min_samples=1, floor=256, ceiling=4096)
+    small.record(*KEY, 10, 1.0)
+    assert small.suggest_max_tokens(*KEY) == 256
+    large = CompletionLengthStats(min_samples=1, floor=256, ceiling=4096)
+    large.record(*KEY, 10000, 1.0)
+    assert large.suggest_max_tokens(*KEY) == 4096
+
+
+def test_predict():
+    """出力トークン数・処理時間の中央値を予測する"""
+    stats = CompletionLengthStats(min_samples=3)
+    assert stats.predict(*KEY) == {
+        "sample_count": 0,
+        "expected_completion_tokens": None,
+        "max_completion_tokens": None,
+        "expected_duration_seconds": None
+    }
+
+    for tokens, duration in [(300, 2.0), (500, 4.0), (400, 3.0)]:
+        stats.record(*KEY, tokens, duration)
+    prediction = stats.predict(*KEY)
+    assert prediction["sample_count"] == 3
+    assert prediction["expected_completion_tokens"] == 400
+    assert prediction["expected_duration_seconds"] == 3.0
+    assert prediction["max_completion_tokens"] == 600
+
+
+def test_save_and_load():
+    """保存した統計を次回起動時に読み込み、記録のたびに自動保存する"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "stats.json")
+        stats = CompletionLengthStats(path, window=3, min_samples=1)
+        for tokens in (100, 200, 300, 400):
+            stats.record(*KEY, tokens, 1.5)
+        stats.record_truncation(*KEY)
+        assert os.path.exists(path)
+        assert [name for name in os.listdir(directory)] == ["stats.json"]
+
+        loaded = CompletionLengthStats(path, window=3, min_samples=1)
+        assert list(loaded.samples[KEY]) == [(200, 1.5), (300, 1.5), (400, 1.5)]
+        assert loaded.truncations[KEY] == 1
+        assert loaded.suggest_max_tokens(*KEY) == stats.suggest_max_tokens(*KEY)
+
+        # 自動保存しない場合は明示的な save() のみ
+        manual_path = os.path.join(directory, "manual.json")
+        manual = CompletionLengthStats(manual_path, autosave=False)
+        manual.record(*KEY, 100, 1.0)
+        assert not os.path.exists(manual_path)
+        manual.save()
+        with open(manual_path, encoding="utf-8") as f:
+            assert json.load(f)["samples"] == [{"key": list(KEY), "samples": [[100, 1.0]]}]
+
+
+def test_shared_file_merges_processes():
+    """同じファイルを共有する複数のインスタンス（ワーカー）が互いのサンプルを上書きしない"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "stats.json")
+        first = CompletionLengthStats(path, min_samples=1)
+        second = CompletionLengthStats(path, min_samples=1)
+
+        first.record(*KEY, 100, 1.0)
+        second.record(*KEY, 200, 2.0)
+        first.record(*KEY, 300, 3.0)
+        second.record_truncation(*KEY)
+        first.record_truncation(*KEY)
+
+        merged = CompletionLengthStats(path)
+        assert sorted(merged.samples[KEY]) == [(100, 1.0), (200, 2.0), (300, 3.0)]
+        assert merged.truncations[KEY] == 2
+        # 保存時にほかのインスタンスの分もメモリ上の統計に反映される
+        assert sorted(first.samples[KEY]) == [(100, 1.0), (200, 2.0), (300, 3.0)]
+
+        # 別のファイルへの保存は現在の統計をそのまま書き出す
+        export_path = os.path.join(directory, "export.json")
+        first.save(export_path)
+        assert sorted(CompletionLengthStats(export_path).samples[KEY]) == sorted(first.samples[KEY])
+
+
+def test_generator_does_not_persist_by_default():
+    """環境変数を設定しない限り、生成器は統計をファイルに保存しない"""
+    previous = os.environ.pop("MATH_COMPLETION_STATS_FILE", None)
+    try:
+        generator = SimpleMathProblemGenerator("test-key", use_local_generator=False)
+        assert generator.completion_stats.path is None
+    finally:
+        if previous is not None:
+            os.environ["MATH_COMPLETION_STATS_FILE"] = previous
+
+
+def test_truncated_at_ceiling():
+    """上限まで広げても打ち切られた結果は truncated として返し、キャッシュしない"""
+    generator = SimpleMathProblemGenerator("test-key", use_local_generator=False)
+    generator.cache = ProblemCache()
+    generator.completion_stats = CompletionLengthStats(min_samples=1, floor=256, ceiling=1024)
+    generator.completion_stats.record(*KEY, 500, 1.0)
+    generator.llm = GenericFakeChatModel(messages=iter([
+        AIMessage(content="1. 類題: 半径が", response_metadata={"finish_reason": "length"}),
+        AIMessage(content="1. 類題: 半径が8cmの", response_metadata={"finish_reason": "length"})
+    ]))
+
+    result = generator.generate_similar_problem(PROBLEM, "中級", verbose=False)
+
+    assert result["truncated"] is True
+    assert result["cost_data"]["max_tokens"] == 1024
+    assert result["cost_data"]["truncation_retries"] == 1
+    assert generator.completion_stats.truncations[KEY] == 2
+    assert generator.cache.index == {}
+
+
+if __name__ == "__main__":
+    test_suggest_max_tokens()
+    test_predict()
+    test_save_and_load()
+    test_shared_file_merges_processes()
+    test_generator_does_not_persist_by_default()
+    test_truncated_at_ceiling()
+    print("出力トークン統計のテストが完了しました")
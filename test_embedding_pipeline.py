@@ -0,0 +1,225 @@
+"""
+埋め込みパイプラインのテスト
+ローカルの模擬埋め込みサーバーを使用（APIキー不要）
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from embedding_pipeline import EmbeddingPipeline, EmbeddingStore, content_hash
+
+DIMENSIONS = 8
+
+
+def fake_embedding(text):
+    """問題文から決まるベクトルを返す"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [byte / 255 for byte in digest[:DIMENSIONS]]
+
+
+class FakeEmbeddingServer:
+    """OpenAI Embeddings API と同じ形式で応答する模擬サーバー"""
+
+    def __init__(self, fail_inputs=(), drop_connections=0):
+        """
+        Args:
+            fail_inputs: これを含むリクエストには常に500を返す
+            drop_connections: 最初のこの回数のリクエストは応答せずに接続を切る
+        """
+        self.requests = []
+        self.fail_inputs = set(fail_inputs)
+        self.drop_connections = drop_connections
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server._lock:
+                    server.requests.append(body["input"])
+                    drop = server.drop_connections > 0
+                    server.drop_connections -= drop
+                if drop:
+                    self.close_connection = True
+                    return
+                if server.fail_inputs & set(body["input"]):
+                    self.send_error(500)
+                    return
+                payload = {
+                    "data": [{"index": i, "embedding": fake_embedding(text)} for i, text in enumerate(body["input"])],
+                    "usage": {"prompt_tokens": 10 * len(body["input"]), "total_tokens": 10 * len(body["input"])}
+                }
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_incremental_reindex():
+    """重複除外・バッチ分割・変更分のみの再インデックスのテスト"""
+    print("=== 埋め込みパイプラインテスト ===")
+    server = FakeEmbeddingServer()
+    problems = [f"x + {i} = {i + 7} を解きなさい。" for i in range(30)]
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = EmbeddingStore(tmpdir, dtype="float16")
+            pipeline = EmbeddingPipeline(store, api_key="sk-test", base_url=server.base_url,
+                                         max_batch_inputs=8, max_workers=3)
+
+            # 重複を含む初回のインデックス作成
+            stats = pipeline.run(problems + problems[:5])
+            print(f"   初回: 新規 {stats['embedded']}件 / キャッシュ {stats['cached']}件 / {stats['batches']}バッチ")
+            assert stats["embedded"] == 30
+            assert stats["cached"] == 5
+            assert all(len(batch) <= 8 for batch in server.requests)
+            assert stats["tokens"] == 300
+
+            vector = store.get(problems[3])
+            assert vector is not None
+            assert np.allclose(vector, fake_embedding(problems[3]), atol=1e-3)
+
+            # 1問だけ変更して再インデックス（ストアを開き直す）
+            server.requests.clear()
+            edited = problems[:]
+            edited[10] = "x + 100 = 107 を解きなさい。"
+            pipeline = EmbeddingPipeline(EmbeddingStore(tmpdir, dtype="float16"), api_key="sk-test",
+                                         base_url=server.base_url)
+            stats = pipeline.run(edited)
+            print(f"   再インデックス: 新規 {stats['embedded']}件 / 送信 {server.requests}")
+            assert stats["embedded"] == 1
+            assert server.requests == [[edited[10]]]
+            assert len(pipeline.store) == 31
+    finally:
+        server.close()
+
+
+def test_token_limit_packing():
+    """バッチがトークン上限を超えないか"""
+    print("\n=== バッチ分割テスト ===")
+    server = FakeEmbeddingServer()
+    problems = [f"問題{i}: " + "三角形の面積を求めなさい。" * (i % 5 + 1) for i in range(40)]
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = EmbeddingPipeline(EmbeddingStore(tmpdir), api_key="sk-test", base_url=server.base_url,
+                                         max_batch_tokens=60)
+            pipeline.run(problems)
+
+            count_tokens = pipeline.calculator.count_tokens
+            for batch in server.requests:
+                batch_tokens = sum(count_tokens(text, pipeline.model) for text in batch)
+                assert batch_tokens <= 60 or len(batch) == 1
+            print(f"   {len(problems)}問を{len(server.requests)}バッチで送信しました")
+    finally:
+        server.close()
+
+
+def test_failed_batch_keeps_completed_batches():
+    """1つのバッチが失敗しても、送信済みのほかのバッチの結果は保存されるか"""
+    problems = [f"x + {i} = {i + 7} を解きなさい。" for i in range(30)]
+    server = FakeEmbeddingServer(fail_inputs={problems[12]})
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = EmbeddingPipeline(EmbeddingStore(tmpdir), api_key="sk-test", base_url=server.base_url,
+                                         max_batch_inputs=5, max_workers=3, max_retries=0)
+            try:
+                pipeline.run(problems)
+                assert False, "失敗したバッチの例外が送出されていません"
+            except requests.HTTPError:
+                pass
+
+            # 失敗したバッチ（10〜14番目）以外の送信済みバッチはすべて保存される
+            sent = [text for batch in server.requests for text in batch]
+            stored = [text for text in sent if pipeline.store.get(text) is not None]
+            assert len(stored) == len(sent) - 5
+            assert problems[12] not in stored
+
+            # 再実行では保存済みの分を送信しない
+            server.requests.clear()
+            server.fail_inputs.clear()
+            pipeline = EmbeddingPipeline(EmbeddingStore(tmpdir), api_key="sk-test", base_url=server.base_url)
+            stats = pipeline.run(problems)
+            assert stats["embedded"] == 30 - len(stored)
+            assert len(pipeline.store) == 30
+    finally:
+        server.close()
+
+
+def test_connection_error_is_retried():
+    """接続エラーは再試行するか"""
+    server = FakeEmbeddingServer(drop_connections=1)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pipeline = EmbeddingPipeline(EmbeddingStore(tmpdir), api_key="sk-test", base_url=server.base_url,
+                                         max_retries=1)
+            stats = pipeline.run(["x + 1 = 8 を解きなさい。"])
+            assert stats["embedded"] == 1
+            assert len(server.requests) == 2
+    finally:
+        server.close()
+
+
+def test_interrupted_append_is_trimmed():
+    """ベクトルの追記後・キーの追記前に中断したストアを開き直しても行がずれないか"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = EmbeddingStore(tmpdir, dtype="float32")
+        store.append([content_hash("a"), content_hash("b")], np.array([[0.0] * 3, [1.0] * 3]))
+
+        # "c" のベクトルだけを書き込んだ状態で中断（途中まで書いた行も含む）
+        with open(store.vectors_path, "ab") as f:
+            f.write(np.full(3, 2.0, dtype=np.float32).tobytes())
+            f.write(np.full(3, 9.0, dtype=np.float32).tobytes()[:5])
+
+        store = EmbeddingStore(tmpdir, dtype="float32")
+        assert len(store) == 2
+        assert os.path.getsize(store.vectors_path) == 2 * 3 * 4
+
+        store.append([content_hash("c")], np.array([[3.0] * 3]))
+        assert np.array_equal(store.get("a"), [0.0] * 3)
+        assert np.array_equal(store.get("b"), [1.0] * 3)
+        assert np.array_equal(store.get("c"), [3.0] * 3)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # 最初の追記でキーを1つも書き込む前に中断
+        store = EmbeddingStore(tmpdir, dtype="float32")
+        store.append([content_hash("a")], np.array([[1.0] * 3]))
+        os.remove(store.keys_path)
+
+        store = EmbeddingStore(tmpdir, dtype="float32")
+        assert len(store) == 0
+        assert os.path.getsize(store.vectors_path) == 0
+
+        store.append([content_hash("b")], np.array([[2.0] * 3]))
+        assert store.get("a") is None
+        assert np.array_equal(store.get("b"), [2.0] * 3)
+
+
+if __name__ == "__main__":
+    test_incremental_reindex()
+    test_token_limit_packing()
+    test_failed_batch_keeps_completed_batches()
+    test_connection_error_is_retried()
+    test_interrupted_append_is_trimmed()
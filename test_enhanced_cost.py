@@ -103,6 +103,68 @@ def test_context_manager():
     
     print_session_summary()
 
+def test_cost_matrix():
+    """一括料金計算のテスト（APIキー不要、NumPyが必要）"""
+    import numpy as np
+    
+    print("\n=== 一括料金計算テスト ===")
+    
+    input_tokens = np.array([120, 300, 0, 4500])
+    output_tokens = np.array([80, 0, 50, 1200])
+    models = ["gpt-4o-mini", "gpt-4o"]
+    
+    matrix = enhanced_calculator.calculate_cost_matrix(
+        input_tokens, output_tokens, models,
+        exchange_rates=[140.0, 150.0], batch_discounts=[0.0, 0.5]
+    )
+    
+    # 1件ずつの計算結果と一致するか
+    for i, model in enumerate(models):
+        pricing = enhanced_calculator.pricing[model]
+        for j in range(len(input_tokens)):
+            expected = input_tokens[j] / 1000 * pricing["input"] + output_tokens[j] / 1000 * pricing["output"]
+            assert abs(matrix["cost_usd"][i, j] - expected) < 1e-12
+        
+        total = matrix["cost_usd"][i].sum()
+        assert abs(matrix["total_cost_usd"][i] - total) < 1e-12
+        assert abs(matrix["total_cost_jpy"][1, 0, i] - total * 140.0 * 0.5) < 1e-9
+        print(f"   {model}: 合計 ${total:.6f}")
+    
+    assert matrix["total_cost_jpy"].shape == (2, 2, 2)
+    
+    # 未知のモデルはエラー
+    try:
+        enhanced_calculator.calculate_cost_matrix(input_tokens, output_tokens, ["unknown-model"])
+        assert False, "未知のモデルでエラーになりませんでした"
+    except ValueError as e:
+        print(f"   未知のモデル: {e}")
+
+def test_cached_prompt_pricing():
+    """プロンプトキャッシュ分の割引料金のテスト（APIキー不要）"""
+    print("\n=== プロンプトキャッシュ料金テスト ===")
+    
+    class MockCallback:
+        prompt_tokens = 2000
+        prompt_tokens_cached = 1536
+        completion_tokens = 300
+        total_tokens = 2300
+        total_cost = 0.0
+    
+    pricing = enhanced_calculator.pricing["gpt-4o-mini"]
+    expected = (464 * pricing["input"] + 1536 * pricing["cached_input"] + 300 * pricing["output"]) / 1000
+    
+    cost = enhanced_calculator.callback_cost(MockCallback(), "gpt-4o-mini")
+    print(f"   キャッシュ済み入力トークン数: {cost['cached_prompt_tokens']}")
+    print(f"   料金（USD）: ${cost['total_cost_usd']:.6f}")
+    assert cost["cached_prompt_tokens"] == 1536
+    assert abs(cost["total_cost_usd"] - expected) < 1e-12
+    
+    # キャッシュなしより安くなる
+    uncached = enhanced_calculator.calculate_cost_from_tokens(2000, 300, "gpt-4o-mini")
+    assert cost["total_cost_usd"] < uncached["total_cost_usd"]
+
 if __name__ == "__main__":
     test_cost_calculation_features()
     test_context_manager()
+    test_cost_matrix()
+    test_cached_prompt_pricing()
@@ -0,0 +1,133 @@
+"""
+類題一括生成（generate_variants）のテスト
+APIキーなしで動作（LLMは模擬チャットモデル）
+"""
+
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from simple_math_generator import SimpleMathProblemGenerator
+
+PROBLEM = "半径が6cmの円の面積を求めなさい。"
+
+
+class FakeBatchChatModel(BaseChatModel):
+    """n個の補完を返し、呼び出しごとの n を記録する模擬チャットモデル"""
+
+    responses: List[List[str]]
+    prompt_tokens: int = 1000
+    requested_n: List[int] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-batch"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        n = kwargs.get("n", 1)
+        self.requested_n.append(n)
+        texts = self.responses.pop(0)[:n]
+        completion_tokens = 40 * len(texts)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text)) for text in texts],
+            llm_output={
+                "model_name": "gpt-4o-mini",
+                "token_usage": {
+                    "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": self.prompt_tokens + completion_tokens
+                }
+            }
+        )
+
+
+def make_generator(responses: List[List[str]]) -> SimpleMathProblemGenerator:
+    generator = SimpleMathProblemGenerator("test-key", use_local_generator=False)
+    generator.llm = FakeBatchChatModel(responses=responses, requested_n=[])
+    return generator
+
+
+def variant(question: str) -> str:
+    return f"1. 問題文: {question}\n2. 解答: 省略\n3. 解説: 省略"
+
+
+def test_single_request_with_n():
+    """k個の類題を n=k の1リクエストで取得する"""
+    generator = make_generator([[variant("半径3cm"), variant("半径4cm"), variant("半径5cm")]])
+
+    result = generator.generate_variants(PROBLEM, k=3, verbose=False)
+
+    assert generator.llm.requested_n == [3]
+    assert result["rounds"] == 1
+    assert result["duplicates"] == 0
+    assert len(result["variants"]) == 3
+
+
+def test_cost_split_matches_callback_total():
+    """類題ごとの按分料金の合計がコールバックの合計料金と一致する"""
+    generator = make_generator([[variant("半径3cm"), variant("半径が10cmの円の面積と円周"), variant("直径8cm")]])
+
+    result = generator.generate_variants(PROBLEM, k=3, verbose=False)
+    costs = [item["cost_data"] for item in result["variants"]]
+
+    assert abs(sum(cost["total_cost_jpy"] for cost in costs) - result["total_cost_jpy"]) < 1e-9
+    assert abs(sum(cost["prompt_tokens"] for cost in costs) - 1000) < 1e-9
+    assert abs(sum(cost["completion_tokens"] for cost in costs) - 120) < 1e-9
+    # 出力トークンは長さに比例して按分される
+    assert costs[1]["completion_tokens"] > costs[0]["completion_tokens"]
+
+
+def test_dedup_requests_missing_variants():
+    """重複した類題を除外し、不足分だけを再リクエストする"""
+    generator = make_generator([
+        [variant("半径3cm"), variant("半径3cm"), variant("半径5cm")],
+        [variant("半径7cm")]
+    ])
+
+    result = generator.generate_variants(PROBLEM, k=3, verbose=False)
+
+    assert generator.llm.requested_n == [3, 1]
+    assert result["rounds"] == 2
+    assert result["duplicates"] == 1
+    assert [generator._variant_key(item["generated_content"]) for item in result["variants"]] == [
+        generator._variant_key(variant(radius)) for radius in ("半径3cm", "半径5cm", "半径7cm")
+    ]
+
+
+def test_dedup_stops_at_max_rounds():
+    """重複が続く場合は max_rounds で打ち切る"""
+    generator = make_generator([[variant("半径3cm")] * 3] * 3)
+
+    result = generator.generate_variants(PROBLEM, k=3, max_rounds=3, verbose=False)
+
+    assert generator.llm.requested_n == [3, 2, 2]
+    assert result["rounds"] == 3
+    assert result["duplicates"] == 6
+    assert len(result["variants"]) == 1
+
+
+def test_exclude_existing_variants():
+    """exclude に渡した既存の類題は重複として扱う"""
+    generator = make_generator([
+        [variant("半径3cm"), variant("半径5cm")],
+        [variant("半径7cm")]
+    ])
+
+    result = generator.generate_variants(PROBLEM, k=2, verbose=False,
+                                         exclude={generator._variant_key(variant("半径3cm"))})
+
+    assert generator.llm.requested_n == [2, 1]
+    assert result["duplicates"] == 1
+    assert len(result["variants"]) == 2
+
+
+if __name__ == "__main__":
+    test_single_request_with_n()
+    test_cost_split_matches_callback_total()
+    test_dedup_requests_missing_variants()
+    test_dedup_stops_at_max_rounds()
+    test_exclude_existing_variants()
+    print("generate_variants のテストが完了しました")
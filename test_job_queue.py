@@ -0,0 +1,201 @@
+"""
+ジョブキューのテスト
+APIキーなしで動作（生成器は模擬オブジェクト）
+"""
+
+import os
+import tempfile
+import time
+from job_queue import JobQueue, run_worker
+
+
+class MockGenerator:
+    """generate_similar_problem と get_session_summary だけを持つ模擬生成器"""
+
+    def __init__(self, fail_problems=()):
+        self.fail_problems = set(fail_problems)
+        self.session_stats = {"total_calls": 0, "total_tokens": 0, "total_cached_tokens": 0,
+                              "total_cost_usd": 0.0, "total_cost_jpy": 0.0}
+
+    def generate_similar_problem(self, problem, difficulty, verbose=True):
+        if problem in self.fail_problems:
+            return {"error": "模擬エラー"}
+        self.session_stats["total_calls"] += 1
+        self.session_stats["total_tokens"] += 100
+        self.session_stats["total_cached_tokens"] += 40
+        self.session_stats["total_cost_jpy"] += 0.5
+        return {
+            "original_problem": problem,
+            "difficulty_level": difficulty,
+            "generated_content": f"{problem}の類題（{difficulty}）",
+            "cost_data": {"total_tokens": 100, "total_cost_jpy": 0.5}
+        }
+
+    def get_session_summary(self):
+        return {"session_stats": self.session_stats.copy()}
+
+
+def _new_queue(tmpdir, **kwargs):
+    return JobQueue(os.path.join(tmpdir, "jobs.db"), **kwargs)
+
+
+def test_visibility_timeout_requeues_crashed_task():
+    """リース切れのタスクがほかのワーカーに再割り当てされるか"""
+    print("=== 可視性タイムアウトテスト ===")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = _new_queue(tmpdir)
+        queue.enqueue("job", ["問題A"], ["中級"])
+
+        # worker-1 が取得したままクラッシュ（リース期間0秒）
+        claimed = queue.claim("job", "worker-1", visibility_timeout=0.0)
+        assert len(claimed) == 1
+
+        # worker-2 が再取得して完了
+        reclaimed = queue.claim("job", "worker-2", visibility_timeout=60.0)
+        assert [task["task_id"] for task in reclaimed] == [claimed[0]["task_id"]]
+        assert reclaimed[0]["attempts"] == 2
+
+        # 遅れて戻ってきた worker-1 の完了報告は無視される
+        assert not queue.complete(claimed[0]["task_id"], "worker-1", {"generated_content": "古い結果"})
+        assert queue.complete(reclaimed[0]["task_id"], "worker-2", {"generated_content": "新しい結果"})
+        assert queue.is_finished("job")
+        print("   ✅ クラッシュしたワーカーのタスクが再処理されました")
+        queue.close()
+
+
+def test_workers_aggregate_summary():
+    """複数ワーカーの統計がジョブ単位で集計されるか"""
+    print("\n=== ジョブ集計テスト ===")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = _new_queue(tmpdir, max_attempts=2)
+        problems = [f"問題{i}" for i in range(5)] + ["失敗する問題"]
+        assert queue.enqueue("job", problems, ["初級", "上級"]) == 12
+
+        # 2つのワーカーで分担（1つ目は途中まで）
+        first = MockGenerator(fail_problems={"失敗する問題"})
+        for task in queue.claim("job", "worker-1", batch_size=4):
+            queue.complete(task["task_id"], "worker-1", first.generate_similar_problem(task["problem"], task["difficulty"]))
+        queue.report_worker_stats("job", "worker-1", first.session_stats, 4, 0, 0.0)
+
+        run_worker(queue, MockGenerator(fail_problems={"失敗する問題"}), "job", worker_id="worker-2", poll_interval=0.0)
+
+        summary = queue.job_summary("job")
+        print(f"   {summary['status_counts']}")
+        assert summary["status_counts"]["done"] == 10
+        assert summary["status_counts"]["failed"] == 2
+        assert summary["session_stats"]["total_calls"] == 10
+        assert summary["session_stats"]["total_cached_tokens"] == 400
+        assert abs(summary["session_stats"]["total_cost_jpy"] - 5.0) < 1e-9
+        assert len(summary["workers"]) == 2
+        assert len(list(queue.results("job"))) == 10
+        queue.close()
+
+
+def test_enqueue_is_idempotent():
+    """同じ問題×難易度の再登録は無視されるか"""
+    print("\n=== 重複登録テスト ===")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = _new_queue(tmpdir)
+        assert queue.enqueue("job", ["問題A", "問題B", "問題A"], ["初級", "上級"]) == 4
+
+        # 中断後に同じ入力で再実行しても増えない（追加分のみ登録）
+        assert queue.enqueue("job", ["問題A", "問題B"], ["初級", "上級"]) == 0
+        assert queue.enqueue("job", ["問題A", "問題C"], ["初級", "上級"]) == 2
+        # 別のジョブには登録できる
+        assert queue.enqueue("other", ["問題A"], ["初級"]) == 1
+
+        assert queue.job_summary("job")["total_tasks"] == 6
+        print("   ✅ 重複したタスクは登録されませんでした")
+        queue.close()
+
+
+class SlowGenerator(MockGenerator):
+    """生成のたびに待機し、その間にほかのワーカーがタスクの取得を試みる"""
+
+    def __init__(self, rival_queue, delay):
+        super().__init__()
+        self.rival_queue = rival_queue
+        self.delay = delay
+        self.stolen = []
+
+    def generate_similar_problem(self, problem, difficulty, verbose=True):
+        time.sleep(self.delay)
+        self.stolen.extend(self.rival_queue.claim("job", "rival", visibility_timeout=60.0, batch_size=10))
+        return super().generate_similar_problem(problem, difficulty, verbose)
+
+
+def test_batch_claim_extends_leases():
+    """まとめて取得したタスクが処理待ちの間にほかのワーカーへ移らないか"""
+    print("\n=== リース延長テスト ===")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = _new_queue(tmpdir)
+        rival_queue = _new_queue(tmpdir)
+        queue.enqueue("job", ["問題A", "問題B", "問題C"], ["中級"])
+
+        # 3件の処理時間（0.9秒）はリース期間（0.5秒）より長いが、1件ずつは収まる
+        generator = SlowGenerator(rival_queue, delay=0.3)
+        stats = run_worker(queue, generator, "job", worker_id="worker-1", visibility_timeout=0.5,
+                           batch_size=3, poll_interval=0.0)
+
+        assert generator.stolen == []
+        assert stats["tasks_done"] == 3
+        assert queue.job_summary("job")["status_counts"]["done"] == 3
+        print("   ✅ 処理待ちのタスクのリースが延長されました")
+        rival_queue.close()
+        queue.close()
+
+
+def test_extend_leases_skips_lost_tasks():
+    """リースが切れてほかのワーカーに移ったタスクは延長しないか"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = _new_queue(tmpdir)
+        queue.enqueue("job", ["問題A", "問題B"], ["中級"])
+
+        first, second = queue.claim("job", "worker-1", visibility_timeout=0.0, batch_size=2)
+        queue.extend_leases([first["task_id"]], "worker-1", visibility_timeout=60.0)
+        # 期限切れの2件目だけが worker-2 に移る
+        assert [task["task_id"] for task in queue.claim("job", "worker-2", batch_size=2)] == [second["task_id"]]
+
+        assert queue.extend_leases([first["task_id"], second["task_id"]], "worker-1") == [first["task_id"]]
+        queue.close()
+
+
+
+class LeaseLosingGenerator(MockGenerator):
+    """生成中にリースが切れ、ほかのワーカーがタスクを取得して完了させる模擬生成器"""
+
+    def __init__(self, rival_queue, fail_problems=()):
+        super().__init__(fail_problems)
+        self.rival_queue = rival_queue
+
+    def generate_similar_problem(self, problem, difficulty, verbose=True):
+        time.sleep(0.2)
+        for task in self.rival_queue.claim("job", "rival", visibility_timeout=60.0):
+            self.rival_queue.complete(task["task_id"], "rival", {"generated_content": "rival"})
+        return super().generate_similar_problem(problem, difficulty, verbose)
+
+
+def test_lost_lease_is_not_counted():
+    """リースが切れた後の失敗・完了はワーカーの統計に数えないか"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = _new_queue(tmpdir)
+        rival_queue = _new_queue(tmpdir)
+        queue.enqueue("job", ["失敗する問題", "問題A"], ["中級"])
+
+        generator = LeaseLosingGenerator(rival_queue, fail_problems={"失敗する問題"})
+        stats = run_worker(queue, generator, "job", worker_id="worker-1", visibility_timeout=0.1,
+                           poll_interval=0.0)
+
+        assert stats["tasks_failed"] == 0
+        assert stats["tasks_done"] == 0
+        assert queue.job_summary("job")["status_counts"]["done"] == 2
+        rival_queue.close()
+        queue.close()
+
+if __name__ == "__main__":
+    test_visibility_timeout_requeues_crashed_task()
+    test_workers_aggregate_summary()
+    test_enqueue_is_idempotent()
+    test_batch_claim_extends_leases()
+    test_extend_leases_skips_lost_tasks()
+    test_lost_lease_is_not_counted()
@@ -0,0 +1,104 @@
+"""
+ローカル類題生成器のテスト
+APIキー・外部パッケージなしで動作
+"""
+
+import re
+from fractions import Fraction
+from local_problem_generator import LocalProblemGenerator
+
+DIFFICULTIES = ["初級", "中級", "上級"]
+
+
+def test_template_detection():
+    """テンプレート判定のテスト"""
+    print("=== テンプレート判定テスト ===")
+    generator = LocalProblemGenerator(seed=0)
+
+    cases = {
+        "x + 5 = 12 を解きなさい。": "linear_equation",
+        "三角形の底辺が8cm、高さが6cmのとき、面積を求めなさい。": "triangle_area",
+        "y = 2x + 3 のグラフについて、x = 4 のときのyの値を求めなさい。": "linear_function",
+        "次の文を読んで答えましょう。64人は80人の0.8にあたります。": "ratio",
+        "x² + 7x + 12 を因数分解しなさい。": None,
+        "半径が6cmの円の面積を求めなさい。": None,
+        # 二次式・両辺に文字がある式・小数係数はローカル生成の対象外
+        "y = x² のグラフについて、x = 3 のときのyの値を求めなさい。": None,
+        "y = 2x² + 1 のグラフについて、x = 3 のときのyの値を求めなさい。": None,
+        "y = x^2 + 1 のグラフについて、x = 3 のときのyの値を求めなさい。": None,
+        "2x + 3 = 4x - 5 を解きなさい。": None,
+        "0.5x + 3 = 7 を解きなさい。": None,
+        "x + 3 = 7.5 を解きなさい。": None,
+        "3x - 4 = 11 を解きなさい。": "linear_equation",
+        "y = -3x - 2 のグラフについて、x = 4 のときのyの値を求めなさい。": "linear_function"
+    }
+
+    for problem, expected in cases.items():
+        template = generator.detect_template(problem)
+        print(f"   {problem[:30]} → {template}")
+        assert template == expected
+
+
+def test_generated_answers_are_correct():
+    """生成された類題の解答が正しいかを検証"""
+    print("\n=== 解答の正しさテスト ===")
+    generator = LocalProblemGenerator(seed=42)
+
+    for difficulty in DIFFICULTIES:
+        for _ in range(50):
+            # 一次方程式: 解を代入して両辺が等しいか
+            result = generator.generate("x + 5 = 12 を解きなさい。", difficulty)
+            question = result["generated_content"].split("\n")[1]
+            x = int(result["answer"].split("=")[1])
+            left, right = question.replace(" を解きなさい。", "").split("=")
+            evaluate = lambda side: eval(re.sub(r'(\d)x', r'\1*x', side).replace("x", f"({x})"))
+            assert evaluate(left) == evaluate(right)
+            # 係数1は「1x」と書かない（解説も問題文と同じ表記）
+            assert not re.search(r'(?<![\d.])1x', result["generated_content"])
+
+            # 三角形の面積: 面積 = 底辺 × 高さ ÷ 2（上級は高さを求める逆問題）
+            result = generator.generate("三角形の底辺が8cm、高さが6cmのとき、面積を求めなさい。", difficulty)
+            question = result["generated_content"].split("\n")[1]
+            if difficulty == "上級":
+                area, base = map(int, re.search(r'面積が(\d+)cm²、底辺が(\d+)cm', question).groups())
+                height = int(re.fullmatch(r'(\d+)cm', result["answer"]).group(1))
+            else:
+                base, height = map(int, re.search(r'底辺が(\d+)cm、高さが(\d+)cm', question).groups())
+                area = int(re.fullmatch(r'(\d+)cm²', result["answer"]).group(1))
+            assert base * height == area * 2
+
+            # 一次関数: 解答の値を式に代入して一致するか（上級はyからxを求める逆問題）
+            result = generator.generate("y = 2x + 3 のグラフについて、x = 4 のときのyの値を求めなさい。", difficulty)
+            question = result["generated_content"].split("\n")[1]
+            expression, given, value = re.search(r'y = (.+?) のグラフについて、([xy]) = (-?\d+) のとき', question).groups()
+            asked, answer = result["answer"].split(" = ")
+            assert asked != given
+            x, y = (int(answer), int(value)) if given == "y" else (int(value), int(answer))
+            assert eval(re.sub(r'(\d)x', r'\1*x', expression).replace("x", f"({x})")) == y
+
+            # 割合: くらべられる量 = もとにする量 × 割合
+            result = generator.generate("64人は80人の0.8にあたります。", difficulty)
+            compared, base, ratio = re.search(r'(\d+)人は(\d+)人の([0-9.]+)', result["generated_content"]).groups()
+            assert Fraction(int(compared)) == int(base) * Fraction(ratio)
+
+    print("   ✅ すべての類題で解答が一致しました")
+
+
+def test_result_shape():
+    """generate_similar_problem と同じ形式で返るか"""
+    print("\n=== 戻り値の形式テスト ===")
+    generator = LocalProblemGenerator(seed=1)
+    result = generator.generate("y = 2x + 3 のグラフについて、x = 4 のときのyの値を求めなさい。", "中級")
+
+    for key in ["original_problem", "difficulty_level", "generated_content", "generation_prompt", "cost_data"]:
+        assert key in result
+    assert result["cost_data"]["total_cost_jpy"] == 0.0
+    print(result["generated_content"])
+
+    assert generator.generate("x² + 7x + 12 を因数分解しなさい。", "中級") is None
+
+
+if __name__ == "__main__":
+    test_template_detection()
+    test_generated_answers_are_correct()
+    test_result_shape()
@@ -0,0 +1,119 @@
+"""
+類題キャッシュのテスト
+APIキーなしで動作
+"""
+
+from problem_cache import ProblemCache, problem_skeleton
+
+TYPE = "一般問題"
+PROBLEM = "半径が6cmの円の面積を求めなさい。"
+SIMILAR_PROBLEM = "半径が9cmの円の面積を求めなさい。"
+
+
+def make_result(content):
+    return {
+        "original_problem": PROBLEM,
+        "difficulty_level": "中級",
+        "generated_content": content,
+        "cost_data": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150,
+                      "total_cost_usd": 0.0001, "total_cost_jpy": 0.015, "model": "gpt-4o-mini"}
+    }
+
+
+def test_problem_skeleton():
+    """数値・文字・人名は抽象化し、指数の次数は区別する"""
+    assert problem_skeleton("x + 5 = 12 を解きなさい。") == "v1+#=#を解きなさい。"
+    assert problem_skeleton("y + 3 = 7 を解きなさい。") == problem_skeleton("x + 5 = 12 を解きなさい。")
+    assert problem_skeleton("太郎さんは3個、花子さんは5個") == problem_skeleton("次郎さんは4個、桜さんは2個")
+    # 全角・半角の違いは同じ骨格
+    assert problem_skeleton("ｘ＋５＝１２") == problem_skeleton("x+5=12")
+
+    # 二次式と三次式は別の骨格（指数の表記ゆれは同じ骨格）
+    assert problem_skeleton("x² + 7x + 12 を因数分解しなさい。") == "v1^2+#v1+#を因数分解しなさい。"
+    assert problem_skeleton("x³ + 7x + 12 を因数分解しなさい。") == "v1^3+#v1+#を因数分解しなさい。"
+    assert problem_skeleton("x^2 + 7x + 12 を因数分解しなさい。") == problem_skeleton("x² + 5x + 6 を因数分解しなさい。")
+
+
+
+def test_forward_and_inverse_problems_differ():
+    """与えられた文字と求める文字が入れ替わった問題は別のキー"""
+    cache = ProblemCache()
+    forward = "y = x² のグラフについて、x = 3 のときのyの値を求めなさい。"
+    inverse = "y = x² のグラフについて、y = 9 のときのxの値を求めなさい。"
+
+    assert cache.make_key(TYPE, forward) != cache.make_key(TYPE, inverse)
+    # 文字の名前が違うだけなら同じキー
+    assert cache.make_key(TYPE, forward) == cache.make_key(TYPE, "b = a² のグラフについて、a = 5 のときのbの値を求めなさい。")
+
+    cache.store(TYPE, forward, "中級", make_result("順方向の類題"))
+    assert cache.lookup(TYPE, inverse, "中級") is None
+
+
+def test_exact_and_skeleton_hits():
+    """同じ問題文の類題を優先し、数値違いの問題にも再利用する"""
+    cache = ProblemCache(max_serves=3)
+    cache.store(TYPE, SIMILAR_PROBLEM, "中級", make_result("類題B"))
+    cache.store(TYPE, PROBLEM, "中級", make_result("類題A"))
+
+    exact = cache.lookup(TYPE, PROBLEM, "中級")
+    assert exact["cache_hit"] == "exact"
+    assert exact["generated_content"] == "類題A"
+    # キャッシュからの提供は料金なし
+    assert exact["cost_data"]["total_tokens"] == 0
+    assert exact["cost_data"]["total_cost_jpy"] == 0.0
+
+    skeleton = cache.lookup(TYPE, "半径が2cmの円の面積を求めなさい。", "中級")
+    assert skeleton["cache_hit"] == "skeleton"
+    assert skeleton["original_problem"] == "半径が2cmの円の面積を求めなさい。"
+
+    # 難易度・問題の種類・次数が異なれば別のキー
+    assert cache.lookup(TYPE, PROBLEM, "上級") is None
+    assert cache.lookup("多肢選択問題", PROBLEM, "中級") is None
+    assert cache.stats == {"exact_hits": 1, "skeleton_hits": 1, "misses": 2}
+    assert cache.hit_rate() == 0.5
+
+
+def test_max_serves():
+    """生成時を含めて max_serves 回まで提供する"""
+    cache = ProblemCache(max_serves=2)
+    cache.store(TYPE, PROBLEM, "中級", make_result("類題A"))
+
+    assert cache.lookup(TYPE, PROBLEM, "中級")["generated_content"] == "類題A"
+    assert cache.lookup(TYPE, PROBLEM, "中級") is None
+    assert cache.index == {}
+
+
+def test_expiry():
+    """期限切れの類題は提供しない"""
+    cache = ProblemCache(max_age_seconds=60)
+    cache.store(TYPE, PROBLEM, "中級", make_result("類題A"))
+    cache.store(TYPE, PROBLEM, "中級", make_result("類題B"))
+
+    # 1件目だけ期限切れにする
+    entries = next(iter(cache.index.values()))
+    entries[0]["created_at"] -= 120
+
+    assert cache.lookup(TYPE, PROBLEM, "中級")["generated_content"] == "類題B"
+    assert [entry["result"]["generated_content"] for entry in entries] == ["類題B"]
+
+
+def test_stored_result_is_copied():
+    """提供した結果を変更してもキャッシュには影響しない"""
+    cache = ProblemCache(max_serves=3)
+    result = make_result("類題A")
+    cache.store(TYPE, PROBLEM, "中級", result)
+    result["generated_content"] = "変更"
+
+    served = cache.lookup(TYPE, PROBLEM, "中級")
+    served["generated_content"] = "変更"
+    assert cache.lookup(TYPE, PROBLEM, "中級")["generated_content"] == "類題A"
+
+
+if __name__ == "__main__":
+    test_problem_skeleton()
+    test_forward_and_inverse_problems_differ()
+    test_exact_and_skeleton_hits()
+    test_max_serves()
+    test_expiry()
+    test_stored_result_is_copied()
+    print("類題キャッシュのテストが完了しました")
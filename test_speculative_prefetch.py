@@ -0,0 +1,113 @@
+"""
+先読み（投機的生成）のテスト
+APIキーなしで動作（生成器は模擬オブジェクト）
+"""
+
+import threading
+import time
+from enhanced_cost_calculator import enhanced_calculator, reset_session_stats
+from local_problem_generator import LocalProblemGenerator
+from speculative_prefetch import SpeculativePrefetcher
+
+PROBLEM = "半径が6cmの円の面積を求めなさい。"
+
+
+class MockGenerator:
+    """generate_similar_problem と local_generator だけを持つ模擬生成器"""
+
+    def __init__(self, delay=0.0, local_generator=None):
+        self.delay = delay
+        self.local_generator = local_generator
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate_similar_problem(self, problem, difficulty, verbose=True):
+        with self._lock:
+            self.calls.append((problem, difficulty))
+        time.sleep(self.delay)
+        return {
+            "original_problem": problem,
+            "difficulty_level": difficulty,
+            "generated_content": f"{problem}の類題（{difficulty}）",
+            "cost_data": {"total_tokens": 100, "total_cost_jpy": 0.5}
+        }
+
+
+def test_get_returns_prefetched_result():
+    """先読み済みの難易度は追加の生成なしで返す"""
+    generator = MockGenerator()
+    prefetcher = SpeculativePrefetcher(generator)
+
+    prefetcher.start(PROBLEM)
+    result = prefetcher.get(PROBLEM, "中級")
+    prefetcher.close()
+
+    assert result["difficulty_level"] == "中級"
+    assert sorted(generator.calls) == sorted((PROBLEM, difficulty) for difficulty in ("初級", "中級", "上級"))
+
+
+def test_get_other_problem_generates_directly():
+    """先読みと異なる問題・未先読みの難易度は通常どおり生成する"""
+    generator = MockGenerator()
+    prefetcher = SpeculativePrefetcher(generator, difficulties=("中級",))
+
+    prefetcher.start(PROBLEM)
+    prefetcher.get("別の問題", "中級")
+    prefetcher.get(PROBLEM, "上級")
+    prefetcher.close()
+
+    assert generator.calls.count(("別の問題", "中級")) == 1
+    assert generator.calls.count((PROBLEM, "上級")) == 1
+
+
+def test_start_skips_local_problems():
+    """定型問題は先読みしない"""
+    generator = MockGenerator(local_generator=LocalProblemGenerator(seed=0))
+    prefetcher = SpeculativePrefetcher(generator)
+
+    prefetcher.start("x + 5 = 12 を解きなさい。")
+    prefetcher.close()
+
+    assert generator.calls == []
+
+
+def test_close_records_running_prefetches():
+    """終了時は実行中の先読みの完了を待ち、使われなかった分を記録してから戻る"""
+    reset_session_stats()
+    generator = MockGenerator(delay=0.2)
+    prefetcher = SpeculativePrefetcher(generator)
+
+    prefetcher.start(PROBLEM)
+    time.sleep(0.05)
+    prefetcher.close()
+
+    stats = enhanced_calculator.get_session_summary()["session_stats"]
+    assert stats["speculative_calls"] == 3
+    assert stats["speculative_tokens"] == 300
+    assert abs(stats["speculative_cost_jpy"] - 1.5) < 1e-9
+
+
+def test_discard_records_unused_results():
+    """別の問題に切り替えると、前の問題の先読み分を記録する"""
+    reset_session_stats()
+    generator = MockGenerator()
+    prefetcher = SpeculativePrefetcher(generator, difficulties=("初級", "中級"))
+
+    prefetcher.start(PROBLEM)
+    prefetcher.get(PROBLEM, "初級")
+    prefetcher.start("別の問題")
+    prefetcher.get("別の問題", "初級")
+    prefetcher.get("別の問題", "中級")
+    prefetcher.close()
+
+    # 使われなかったのは最初の問題の「中級」のみ
+    assert enhanced_calculator.get_session_summary()["session_stats"]["speculative_calls"] == 1
+
+
+if __name__ == "__main__":
+    test_get_returns_prefetched_result()
+    test_get_other_problem_generates_directly()
+    test_start_skips_local_problems()
+    test_close_records_running_prefetches()
+    test_discard_records_unused_results()
+    print("先読みのテストが完了しました")
@@ -0,0 +1,135 @@
+"""
+トレース・プロファイリングのテスト
+APIキーなしで動作
+"""
+
+import json
+import os
+import tempfile
+import time
+from tracing import Tracer, STATUS_CODE_ERROR, STATUS_CODE_OK
+
+
+def read_spans(path):
+    """出力ファイルからスパンを読み込む（ExportTraceServiceRequest 1件につき1スパン）"""
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    return [record["resourceSpans"][0]["scopeSpans"][0]["spans"][0] for record in records]
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_span_nesting():
+    """入れ子のスパンは同じトレースIDを持ち、親のスパンIDを参照する"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        tracer = Tracer(output_path=path)
+
+        with tracer.span("root"):
+            with tracer.span("child"):
+                with tracer.span("grandchild"):
+                    pass
+            with tracer.span("sibling"):
+                pass
+        with tracer.span("second_root"):
+            pass
+
+        # スパンは終了順に出力される
+        spans = {span["name"]: span for span in read_spans(path)}
+        assert list(spans) == ["grandchild", "child", "sibling", "root", "second_root"]
+
+        root = spans["root"]
+        assert root["parentSpanId"] == ""
+        assert spans["child"]["parentSpanId"] == root["spanId"]
+        assert spans["sibling"]["parentSpanId"] == root["spanId"]
+        assert spans["grandchild"]["parentSpanId"] == spans["child"]["spanId"]
+        assert {spans[name]["traceId"] for name in ("root", "child", "grandchild", "sibling")} == {root["traceId"]}
+
+        # 別のルートスパンは別のトレース
+        assert spans["second_root"]["parentSpanId"] == ""
+        assert spans["second_root"]["traceId"] != root["traceId"]
+
+
+def test_otlp_record_shape():
+    """OTLP/JSON（ExportTraceServiceRequest）の形式で出力する"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.jsonl")
+        tracer = Tracer(output_path=path, service_name="test-service")
+
+        with tracer.span("operation", model="gpt-4o-mini", tokens=12, cost=0.5, cached=True) as span:
+            span.set_attribute("result", "ok")
+        try:
+            with tracer.span("failing"):
+                raise ValueError("失敗")
+        except ValueError:
+            pass
+
+        with open(path, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        resource_spans = record["resourceSpans"][0]
+        assert resource_spans["resource"]["attributes"] == [
+            {"key": "service.name", "value": {"stringValue": "test-service"}}
+        ]
+        assert resource_spans["scopeSpans"][0]["scope"]["name"] == "math_problem_generator.tracing"
+
+        operation, failing = read_spans(path)
+        assert len(operation["traceId"]) == 32
+        assert len(operation["spanId"]) == 16
+        assert operation["kind"] == 1
+        assert int(operation["endTimeUnixNano"]) >= int(operation["startTimeUnixNano"]) > 0
+        assert operation["status"] == {"code": STATUS_CODE_OK}
+        assert operation["attributes"] == [
+            {"key": "model", "value": {"stringValue": "gpt-4o-mini"}},
+            {"key": "tokens", "value": {"intValue": "12"}},
+            {"key": "cost", "value": {"doubleValue": 0.5}},
+            {"key": "cached", "value": {"boolValue": True}},
+            {"key": "result", "value": {"stringValue": "ok"}}
+        ]
+        assert failing["status"] == {"code": STATUS_CODE_ERROR, "message": "失敗"}
+
+
+def test_disabled_tracer_writes_nothing():
+    """トレース無効時は何も出力しない"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            tracer = Tracer()
+            tracer.disable()
+            with tracer.span("root") as span:
+                span.set_attribute("ignored", 1)
+            assert os.listdir(directory) == []
+        finally:
+            os.chdir(cwd)
+
+
+def test_profile_path():
+    """プロファイルは指定した出力先に書き込み、書き込み先をスパン属性に記録する"""
+    with tempfile.TemporaryDirectory() as directory:
+        trace_path = os.path.join(directory, "trace.jsonl")
+        tracer = Tracer(output_path=trace_path)
+        with tracer.span("profiled", profile=True) as span:
+            busy_wait(0.05)
+        assert span.attributes["profile.path"] == os.path.abspath(f"{trace_path}.folded")
+
+        profile_path = os.path.join(directory, "explicit.folded")
+        tracer = Tracer(profile_path=profile_path)
+        tracer.disable()
+        with tracer.span("profiled", profile=True) as span:
+            busy_wait(0.05)
+        assert span.attributes["profile.path"] == os.path.abspath(profile_path)
+        with open(profile_path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert lines and all(line.startswith(f"profiled[{span.span_id}];") for line in lines)
+
+
+if __name__ == "__main__":
+    test_span_nesting()
+    test_otlp_record_shape()
+    test_disabled_tracer_writes_nothing()
+    test_profile_path()
+    print("トレースのテストが完了しました")
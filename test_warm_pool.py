@@ -0,0 +1,175 @@
+"""
+ウォームプールのテスト
+APIキーなしで動作（生成器は模擬オブジェクト）
+"""
+
+from warm_pool import WarmPool
+
+PROBLEM_A = "半径が6cmの円の面積を求めなさい。"
+PROBLEM_B = "1辺が4cmの正方形の対角線の長さを求めなさい。"
+
+
+class MockGenerator:
+    """ウォームプールが使うメソッドだけを持つ模擬生成器（類題1つあたり cost_per_variant 円）"""
+
+    def __init__(self, cost_per_variant=0.1, distinct=True, problem_costs=None):
+        self.local_generator = None
+        self.cost_per_variant = cost_per_variant
+        self.problem_costs = problem_costs or {}
+        self.distinct = distinct
+        self.counter = 0
+        self.variant_calls = []
+        self.similar_calls = []
+
+    def _variant_key(self, content):
+        return content
+
+    def _next_content(self, problem):
+        if self.distinct:
+            self.counter += 1
+        return f"{problem}の類題{self.counter}"
+
+    def generate_similar_problem(self, problem, difficulty):
+        self.similar_calls.append((problem, difficulty))
+        return {"generated_content": self._next_content(problem),
+                "cost_data": {"total_tokens": 100, "total_cost_jpy": self.cost_per_variant}}
+
+    def generate_variants(self, problem, difficulty, k=5, verbose=True, exclude=None):
+        self.variant_calls.append((problem, difficulty, k, set(exclude or ())))
+        variants = []
+        for _ in range(k):
+            content = self._next_content(problem)
+            if content not in (exclude or ()):
+                variants.append({"generated_content": content, "cost_data": {"total_cost_jpy": self.cost_per_variant}})
+        return {"variants": variants, "total_cost_jpy": self._cost(problem) * k, "requested": k}
+
+    def predict_request(self, problem, difficulty):
+        return {"expected_cost_jpy": self._cost(problem), "max_cost_jpy": self._cost(problem)}
+
+    def _cost(self, problem):
+        return self.problem_costs.get(problem, self.cost_per_variant)
+
+
+def test_pool_hits():
+    """補充した類題をプールから返し、提供済みの類題は生成時に除外させる"""
+    generator = MockGenerator()
+    pool = WarmPool(generator, pool_size=2)
+
+    served = pool.generate_similar_problem(PROBLEM_A)
+    assert "warm_pool_hit" not in served
+
+    assert pool.refill_once() is True
+    # 提供済みの類題を除外対象として渡す
+    assert generator.variant_calls == [(PROBLEM_A, "中級", 2, {served["generated_content"]})]
+
+    first = pool.generate_similar_problem(PROBLEM_A)
+    second = pool.generate_similar_problem(PROBLEM_A)
+    assert first["warm_pool_hit"] and second["warm_pool_hit"]
+    # 補充時に計上済みの料金は提供時には数えない（元の料金は refill_cost_jpy に残す）
+    assert first["cost_data"]["total_cost_jpy"] == 0.0
+    assert first["cost_data"]["refill_cost_jpy"] == generator.cost_per_variant
+    assert len({served["generated_content"], first["generated_content"], second["generated_content"]}) == 3
+
+    # プールが空になったら通常どおり生成
+    assert "warm_pool_hit" not in pool.generate_similar_problem(PROBLEM_A)
+    stats = pool.get_stats()
+    assert stats["pool_hits"] == 2
+    assert stats["pool_misses"] == 2
+    assert len(generator.similar_calls) == 2
+
+
+def test_refill_skips_full_pools():
+    """プールが満たされたキーは補充しない"""
+    generator = MockGenerator()
+    pool = WarmPool(generator, pool_size=2)
+    pool.generate_similar_problem(PROBLEM_A)
+
+    assert pool.refill_once() is True
+    assert pool.refill_once() is False
+    assert len(generator.variant_calls) == 1
+
+
+def test_empty_refill_backs_off():
+    """新しい類題が得られない補充はFalseを返し、そのキーを一定時間補充しない"""
+    generator = MockGenerator(distinct=False)
+    pool = WarmPool(generator, pool_size=3, budget_jpy=100.0)
+    pool.generate_similar_problem(PROBLEM_A)
+
+    # 生成器が提供済みと同じ類題しか返さない
+    assert pool.refill_once() is False
+    assert pool.refill_once() is False
+    assert len(generator.variant_calls) == 1
+
+    stats = pool.get_stats()
+    assert stats["empty_refills"] == 1
+    assert stats["backed_off_keys"] == 1
+    assert stats["spent_jpy"] < 1.0
+
+    # 待機時間が過ぎれば再び補充する
+    pool.retry_after_seconds = 0.0
+    pool.retry_after = {}
+    pool.refill_once()
+    assert len(generator.variant_calls) == 2
+
+
+def test_hot_key_eviction():
+    """頻度の上位から外れたキーのプールは解放し、上位のキーを補充する"""
+    generator = MockGenerator()
+    pool = WarmPool(generator, hot_keys=1, pool_size=2)
+
+    pool.generate_similar_problem(PROBLEM_A)
+    assert pool.refill_once() is True
+    assert (PROBLEM_A, "中級") in pool.pools
+
+    for _ in range(2):
+        pool.generate_similar_problem(PROBLEM_B)
+    assert pool.refill_once() is True
+
+    assert list(pool.pools) == [(PROBLEM_B, "中級")]
+    assert generator.variant_calls[-1][0] == PROBLEM_B
+
+
+def test_budget_stop():
+    """残りの予算に収まる数だけ補充し、予算を使い切ったら止める"""
+    generator = MockGenerator(cost_per_variant=0.25)
+    pool = WarmPool(generator, pool_size=3, budget_jpy=1.0)
+
+    for problem in (PROBLEM_A, PROBLEM_A, PROBLEM_B):
+        pool.generate_similar_problem(problem)
+
+    # 1回目: 3つで見込み 0.75円 ≤ 1.0円 → 3つ補充
+    assert pool.refill_once() is True
+    # 2回目: 残り 0.25円 → 1つだけ補充
+    assert pool.refill_once() is True
+    # 予算を使い切ったので補充しない
+    assert pool.refill_once() is False
+
+    assert [call[2] for call in generator.variant_calls] == [3, 1]
+    assert abs(pool.get_stats()["spent_jpy"] - pool.budget_jpy) < 1e-9
+
+
+def test_unaffordable_key_is_skipped():
+    """1つも予算に収まらないキーは待機させ、ほかのキーを補充する"""
+    generator = MockGenerator(cost_per_variant=0.2, problem_costs={PROBLEM_A: 5.0})
+    pool = WarmPool(generator, pool_size=3, budget_jpy=1.0)
+
+    for problem in (PROBLEM_A, PROBLEM_A, PROBLEM_B):
+        pool.generate_similar_problem(problem)
+
+    assert pool.refill_once() is False
+    assert pool.refill_once() is True
+    assert [call[0] for call in generator.variant_calls] == [PROBLEM_B]
+
+    stats = pool.get_stats()
+    assert stats["budget_skips"] == 1
+    assert stats["backed_off_keys"] == 1
+
+
+if __name__ == "__main__":
+    test_pool_hits()
+    test_refill_skips_full_pools()
+    test_empty_refill_backs_off()
+    test_hot_key_eviction()
+    test_budget_stop()
+    test_unaffordable_key_is_skipped()
+    print("ウォームプールのテストが完了しました")
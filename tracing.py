@@ -0,0 +1,238 @@
+"""
+処理フェーズごとのトレース・プロファイリングモジュール
+OpenTelemetry互換（OTLP/JSON）のスパンをローカルファイルに出力する
+"""
+
+import os
+import sys
+import json
+import logging
+import secrets
+import threading
+import time
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+# OTLPのステータスコード
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+# OTLPのスパン種別（INTERNAL）
+SPAN_KIND_INTERNAL = 1
+# トレース無効かつ出力先の指定がない場合のプロファイル出力先
+DEFAULT_PROFILE_PATH = "profile.folded"
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "start_time_ns", "end_time_ns",
+                 "attributes", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = 0
+        self.attributes = attributes
+        self.status = {"code": STATUS_CODE_OK}
+
+    def set_attribute(self, key: str, value: Any):
+        """スパンに属性を追加"""
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP/JSON形式のスパンに変換"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": self.status
+        }
+
+
+class _NoopSpan:
+    """トレース無効時に返すスパン（何もしない）"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    """属性値をOTLPのAnyValue形式に変換"""
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        サンプリングプロファイラの初期化
+
+        Args:
+            thread_id: サンプリング対象のスレッドID
+            interval: サンプリング間隔（秒）
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """サンプリングを開始"""
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """サンプリングを停止し、スタックごとのサンプル数を返す"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            # flamegraph.pl / speedscope で読める「外側;…;内側」形式
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+
+class Tracer:
+    def __init__(self, output_path: Optional[str] = None, profile_path: Optional[str] = None,
+                 service_name: str = "math-problem-generator"):
+        """
+        トレーサーの初期化
+
+        Args:
+            output_path: スパンの出力先（JSON Lines）。省略時は環境変数 MATH_TRACE_FILE、未設定なら無効
+            profile_path: プロファイルの出力先（collapsed stack）。省略時は環境変数 MATH_PROFILE_FILE、
+                未設定なら "<output_path>.folded"
+            service_name: リソース属性 service.name の値
+        """
+        self.output_path = output_path or os.getenv("MATH_TRACE_FILE")
+        self.profile_path = profile_path or os.getenv("MATH_PROFILE_FILE")
+        self.service_name = service_name
+        self._current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.output_path is not None
+
+    def enable(self, output_path: str, profile_path: Optional[str] = None):
+        """トレースを有効化"""
+        self.output_path = output_path
+        if profile_path is not None:
+            self.profile_path = profile_path
+
+    def disable(self):
+        """トレースを無効化"""
+        self.output_path = None
+
+    @contextmanager
+    def span(self, name: str, profile: bool = False, **attributes):
+        """
+        スパンを計測するコンテキストマネージャー
+
+        Args:
+            name: スパン名
+            profile: スパンの間サンプリングプロファイラを動かすか
+            attributes: スパンの属性
+        """
+        if not self.enabled and not profile:
+            yield _NOOP_SPAN
+            return
+
+        parent = self._current_span.get()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent else secrets.token_hex(16),
+            parent_span_id=parent.span_id if parent else "",
+            attributes=attributes
+        )
+        token = self._current_span.set(span)
+
+        profiler = None
+        if profile:
+            profiler = SamplingProfiler(threading.get_ident())
+            profiler.start()
+
+        try:
+            yield span
+        except Exception as e:
+            span.status = {"code": STATUS_CODE_ERROR, "message": str(e)}
+            raise
+        finally:
+            if profiler is not None:
+                samples = profiler.stop()
+                span.set_attribute("profile.samples", sum(samples.values()))
+                span.set_attribute("profile.path", self._write_profile(span, samples))
+
+            span.end_time_ns = time.time_ns()
+            self._current_span.reset(token)
+            if self.enabled:
+                self._export(span)
+
+    def _export(self, span: Span):
+        """スパンをOTLP/JSON（ExportTraceServiceRequest）として1行ずつ追記"""
+        record = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "math_problem_generator.tracing"},
+                    "spans": [span.to_otlp()]
+                }]
+            }]
+        }
+        with self._lock:
+            with open(self.output_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _write_profile(self, span: Span, samples: Counter) -> str:
+        """
+        サンプリング結果を collapsed stack 形式で追記
+
+        Returns:
+            書き込んだファイルの絶対パス
+        """
+        if self.profile_path:
+            profile_path = self.profile_path
+        elif self.output_path:
+            profile_path = f"{self.output_path}.folded"
+        else:
+            profile_path = DEFAULT_PROFILE_PATH
+            logging.warning(f"プロファイルの出力先が未指定のため {os.path.abspath(profile_path)} に書き込みます"
+                            f"（MATH_PROFILE_FILE で指定できます）")
+
+        with self._lock:
+            with open(profile_path, "a", encoding="utf-8") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{span.name}[{span.span_id}];{stack} {count}\n")
+        return os.path.abspath(profile_path)
+
+
+# グローバルインスタンス
+tracer = Tracer()
@@ -0,0 +1,249 @@
+"""
+よく使われる問題の類題を事前生成しておくウォームプール
+アイドル時間にバックグラウンドで補充し、リクエストにはプールから即座に返す
+"""
+
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Any, Deque, Optional, Set, Tuple
+
+PoolKey = Tuple[str, str]
+
+
+class WarmPool:
+    def __init__(self, generator, hot_keys: int = 200, pool_size: int = 3, budget_jpy: float = 100.0,
+                 idle_seconds: float = 2.0, check_interval: float = 1.0, retry_after_seconds: float = 600.0):
+        """
+        ウォームプールの初期化
+
+        Args:
+            generator: SimpleMathProblemGenerator のインスタンス
+            hot_keys: 事前生成の対象にする (問題, 難易度) の数（リクエスト頻度の上位）
+            pool_size: 1つの (問題, 難易度) あたりに保持する未提供の類題数
+            budget_jpy: 事前生成に使ってよい料金の上限（円）
+            idle_seconds: 最後のリクエストからこの秒数が経過したら補充を開始
+            check_interval: 補充スレッドの確認間隔（秒）
+            retry_after_seconds: 補充で新しい類題が得られなかったキーを再び補充するまでの秒数
+        """
+        self.generator = generator
+        self.hot_keys = hot_keys
+        self.pool_size = pool_size
+        self.budget_jpy = budget_jpy
+        self.idle_seconds = idle_seconds
+        self.check_interval = check_interval
+        self.retry_after_seconds = retry_after_seconds
+
+        self.request_counts: Counter = Counter()
+        self.pools: Dict[PoolKey, Deque[Dict[str, Any]]] = {}
+        # 提供済み・プール済みの類題（同じ類題を二度返さないため）
+        self.seen_variants: Dict[PoolKey, Set[str]] = {}
+        # 新しい類題が得られなかったキー → 再補充できる時刻（time.monotonic）
+        self.retry_after: Dict[PoolKey, float] = {}
+        self.last_request_time = time.monotonic()
+
+        self.stats = {
+            "pool_hits": 0,
+            "pool_misses": 0,
+            "refill_calls": 0,
+            "empty_refills": 0,
+            "budget_skips": 0,
+            "generated_variants": 0,
+            "pooled_variants": 0,
+            "spent_jpy": 0.0
+        }
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """バックグラウンドの補充を開始"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._refill_loop, name="warm-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """バックグラウンドの補充を停止"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def generate_similar_problem(self, original_problem: str, difficulty_level: str = "中級") -> Dict[str, Any]:
+        """プールにあればそこから、なければ通常どおり類題を生成"""
+        key = (original_problem, difficulty_level)
+
+        with self._lock:
+            self.request_counts[key] += 1
+            self.last_request_time = time.monotonic()
+            pool = self.pools.get(key)
+            variant = pool.popleft() if pool else None
+            self.stats["pool_hits" if variant else "pool_misses"] += 1
+
+        if variant is not None:
+            variant["warm_pool_hit"] = True
+            # 料金は補充時にセッション統計へ計上済みのため、提供時は料金なしとする
+            if "cost_data" in variant:
+                variant["cost_data"] = {
+                    **variant["cost_data"],
+                    "prompt_tokens": 0,
+                    "cached_prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                    "total_cost_usd": 0.0,
+                    "total_cost_jpy": 0.0,
+                    "refill_cost_jpy": variant["cost_data"].get("total_cost_jpy", 0.0)
+                }
+            return variant
+
+        result = self.generator.generate_similar_problem(original_problem, difficulty_level)
+        if "generated_content" in result:
+            with self._lock:
+                self.seen_variants.setdefault(key, set()).add(
+                    self.generator._variant_key(result["generated_content"])
+                )
+        return result
+
+    def refill_once(self) -> bool:
+        """
+        最も頻度の高い不足中のキーを1つ補充
+
+        残りの予算で足りない場合は、予算内に収まる数だけを生成する
+
+        Returns:
+            プールに類題を追加したか（対象がない・予算超過・新しい類題が得られなかった場合はFalse）
+        """
+        key = self._next_refill_key()
+        if key is None:
+            return False
+
+        problem, difficulty = key
+        with self._lock:
+            needed = self.pool_size - len(self.pools.get(key, ()))
+            spent = self.stats["spent_jpy"]
+            # 提供済み・プール済みの類題は生成時点で重複として除外させる
+            exclude = set(self.seen_variants.get(key, ()))
+
+        # 呼び出し後の支出が予算を超えないよう生成数を減らす
+        variant_cost = self._estimate_variant_cost(problem, difficulty)
+        if variant_cost > 0:
+            needed = min(needed, int((self.budget_jpy - spent) // variant_cost))
+        if needed <= 0:
+            # 1つも予算に収まらないキーは待機させ、ほかのキーの補充を妨げない
+            with self._lock:
+                self.stats["budget_skips"] += 1
+                self._back_off(key)
+            return False
+
+        result = self.generator.generate_variants(problem, difficulty, k=needed, verbose=False, exclude=exclude)
+
+        with self._lock:
+            if "error" in result:
+                self.stats["empty_refills"] += 1
+                self._back_off(key)
+                return False
+
+            self.stats["refill_calls"] += 1
+            self.stats["generated_variants"] += len(result["variants"])
+            self.stats["spent_jpy"] += result["total_cost_jpy"]
+
+            # ホットでなくなったキーは補充結果を捨てる
+            if key not in self._hot_key_set():
+                return False
+
+            pool = self.pools.setdefault(key, deque())
+            seen = self.seen_variants.setdefault(key, set())
+            added = 0
+            for variant in result["variants"]:
+                variant_key = self.generator._variant_key(variant["generated_content"])
+                if variant_key in seen or len(pool) >= self.pool_size:
+                    continue
+                seen.add(variant_key)
+                pool.append(variant)
+                added += 1
+            self.stats["pooled_variants"] += added
+
+            # 新しい類題が得られないキーは一定時間補充しない（同じキーへの課金の繰り返しを防ぐ）
+            if added == 0:
+                self.stats["empty_refills"] += 1
+                self._back_off(key)
+                return False
+            self.retry_after.pop(key, None)
+
+        return True
+
+    def _back_off(self, key: PoolKey):
+        self.retry_after[key] = time.monotonic() + self.retry_after_seconds
+
+    def _estimate_variant_cost(self, problem: str, difficulty: str) -> float:
+        """
+        類題1つあたりの料金の見込み（円）
+
+        補充の実績があれば類題1つあたりの平均料金から、なければ1問生成の予測料金から見積もる
+        （1問生成の予測料金は入力トークンを共有しない分、類題1つあたりより高めになる）
+        """
+        with self._lock:
+            generated = self.stats["generated_variants"]
+            spent = self.stats["spent_jpy"]
+        if generated:
+            return spent / generated
+
+        prediction = self.generator.predict_request(problem, difficulty)
+        per_variant = prediction["expected_cost_jpy"]
+        if per_variant is None:
+            per_variant = prediction["max_cost_jpy"] or 0.0
+        return per_variant
+
+    def _hot_key_set(self) -> Set[PoolKey]:
+        return {key for key, _ in self.request_counts.most_common(self.hot_keys)}
+
+    def _next_refill_key(self) -> Optional[PoolKey]:
+        """補充対象のキーを選ぶ（予算内かつ頻度順）"""
+        local_generator = self.generator.local_generator
+        now = time.monotonic()
+
+        with self._lock:
+            if self.stats["spent_jpy"] >= self.budget_jpy:
+                return None
+
+            hot_keys = self._hot_key_set()
+
+            # ホットでなくなったキーのプールは解放
+            for key in list(self.pools):
+                if key not in hot_keys:
+                    del self.pools[key]
+
+            for key, _ in self.request_counts.most_common(self.hot_keys):
+                # 定型問題はローカル生成で即座に返るため対象外
+                if local_generator is not None and local_generator.can_handle(key[0]):
+                    continue
+                # 直近の補充で新しい類題が得られなかったキーは待機
+                if self.retry_after.get(key, 0.0) > now:
+                    continue
+                if len(self.pools.get(key, ())) < self.pool_size:
+                    return key
+        return None
+
+    def _refill_loop(self):
+        while not self._stop_event.wait(self.check_interval):
+            # リクエスト処理中は補充しない
+            if time.monotonic() - self.last_request_time < self.idle_seconds:
+                continue
+            # アイドルが続く間は連続して補充
+            while not self._stop_event.is_set() and self.refill_once():
+                if time.monotonic() - self.last_request_time < self.idle_seconds:
+                    break
+
+    def get_stats(self) -> Dict[str, Any]:
+        """プールの統計を取得"""
+        with self._lock:
+            return {
+                **self.stats,
+                "pooled_keys": len(self.pools),
+                "ready_variants": sum(len(pool) for pool in self.pools.values()),
+                "backed_off_keys": sum(1 for until in self.retry_after.values() if until > time.monotonic()),
+                "tracked_keys": len(self.request_counts)
+            }